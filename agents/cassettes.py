@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+import json
+import os
+import threading
+from collections import defaultdict
+from datetime import timezone
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+from utils.executor import run_sync
+
+load_dotenv()
+
+LLM_CASSETTE_MODE = os.getenv('LLM_CASSETTE_MODE', 'off')
+LLM_CASSETTE_DIR = os.getenv('LLM_CASSETTE_DIR', 'cassettes')
+LLM_CASSETTE_MATCH = os.getenv('LLM_CASSETTE_MATCH', 'exact')
+LLM_CASSETTE_SPEED = float(os.getenv('LLM_CASSETTE_SPEED', '1'))
+
+
+class CassetteMissError(Exception):
+    """Raised in replay mode when no recording matches the call"""
+
+
+class CassetteStore:
+    """Records agent calls to disk and serves them back with their original timing.
+
+    mode: 'off', 'record' or 'replay'
+    match: 'exact' only replays a recording of the identical prompt, 'sequence' falls back to the agent's
+        recordings in the order they were made, so changed prompts can be replayed against real outputs
+    speed: replay timing multiplier, 0 replays instantly, 2 twice as fast
+    """
+
+    def __init__(self, mode: str = LLM_CASSETTE_MODE, directory: str = LLM_CASSETTE_DIR, match: str = LLM_CASSETTE_MATCH, speed: float = LLM_CASSETTE_SPEED):
+        self.configure(mode, directory, match, speed)
+
+    def configure(self, mode: str, directory: str = LLM_CASSETTE_DIR, match: str = 'exact', speed: float = 1.0):
+        if mode not in ('off', 'record', 'replay'):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.mode = mode
+        self.directory = Path(directory)
+        self.match = match
+        self.speed = speed
+        self._sequence_positions: dict[str, int] = defaultdict(int)
+        self._sequence_cache: dict[str, list[Path]] = {}
+        self._sequence_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'off'
+
+    def _path(self, agent_name: str, key: str) -> Path:
+        return self.directory / agent_name / f"{key}.json"
+
+    async def record(self, agent_name: str, key: str, model: str, messages: list[dict], output: dict, latency_ms: float):
+        cassette = {
+            'agent': agent_name,
+            'model': model,
+            'key': key,
+            'messages': messages,
+            'output': output,
+            'latency_ms': latency_ms,
+            'recordedAt': datetime.datetime.now(timezone.utc).isoformat(),
+        }
+        path = self._path(agent_name, key)
+
+        def write():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(cassette, ensure_ascii=False, indent=2), encoding='utf-8')
+
+        await run_sync(write)
+
+    def _next_in_sequence(self, agent_name: str) -> Optional[Path]:
+        with self._sequence_lock:
+            return self._next_in_sequence_locked(agent_name)
+
+    def _next_in_sequence_locked(self, agent_name: str) -> Optional[Path]:
+        if agent_name not in self._sequence_cache:
+            recordings = []
+            for path in (self.directory / agent_name).glob('*.json'):
+                recorded_at = json.loads(path.read_text(encoding='utf-8')).get('recordedAt', '')
+                recordings.append((recorded_at, path))
+            self._sequence_cache[agent_name] = [path for _, path in sorted(recordings)]
+
+        recordings = self._sequence_cache[agent_name]
+        if not recordings:
+            return None
+        position = self._sequence_positions[agent_name]
+        self._sequence_positions[agent_name] = position + 1
+        return recordings[position % len(recordings)]
+
+    async def replay(self, agent_name: str, key: str) -> dict:
+        def read() -> Optional[dict]:
+            path = self._path(agent_name, key)
+            if not path.exists() and self.match == 'sequence':
+                path = self._next_in_sequence(agent_name)
+            if path is None or not path.exists():
+                return None
+            return json.loads(path.read_text(encoding='utf-8'))
+
+        cassette = await run_sync(read)
+        if cassette is None:
+            raise CassetteMissError(f"No cassette for {agent_name} call {key} in {self.directory}")
+
+        if self.speed > 0:
+            await asyncio.sleep(cassette['latency_ms'] / 1000 / self.speed)
+        return cassette['output']
+
+
+cassettes = CassetteStore()
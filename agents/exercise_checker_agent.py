@@ -1,5 +1,8 @@
+from langchain_groq import ChatGroq
 from langchain_openai import ChatOpenAI
+from agents.structured_agent import StructuredAgent
 from pydantic import BaseModel, Field
+from typing import List
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -39,11 +42,51 @@ exercise_checker_system_prompt = """
     **Important:** Be encouraging and educational in your explanations.
 """
 
+batch_exercise_checker_system_prompt = exercise_checker_system_prompt + """
+    **Several Answers:**
+    You will be given the LESSON CONTENT once, followed by several exercises, each with its EXERCISE INDEX, QUESTION and USER'S ANSWER.
+    - Evaluate every exercise on its own, following the rules above
+    - Return exactly one entry in 'answers' for every exercise, with its 'exercise_index' copied unchanged
+"""
+
 class Answer(BaseModel):
     is_correct: bool
     additional_explanation: str = Field(default="")
 
-exercise_checker = ChatOpenAI(
+class IndexedAnswer(Answer):
+    exercise_index: int
+
+class AnswerList(BaseModel):
+    answers: List[IndexedAnswer]
+
+exercise_checker = StructuredAgent(
+    'exercise_checker',
+    ChatOpenAI(
+        model='gpt-4o-mini',
+        temperature=0.2,
+    ),
+    Answer,
+    cache=True,
+    fallbacks=[
+        ChatGroq(
+            model='llama-3.3-70b-versatile',
+            temperature=0.2,
+        ),
+    ],
+)
+
+batch_exercise_checker = StructuredAgent(
+    'batch_exercise_checker',
+    ChatOpenAI(
         model='gpt-4o-mini',
         temperature=0.2,
-    ).with_structured_output(Answer)
\ No newline at end of file
+    ),
+    AnswerList,
+    cache=True,
+    fallbacks=[
+        ChatGroq(
+            model='llama-3.3-70b-versatile',
+            temperature=0.2,
+        ),
+    ],
+)
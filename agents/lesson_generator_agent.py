@@ -2,6 +2,7 @@ from langchain_groq import ChatGroq
 from models.Lesson import Lesson
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
+from agents.structured_agent import StructuredAgent
 
 load_dotenv()
 
@@ -86,9 +87,20 @@ lesson_generator_system_prompt = """
        - Ensure the lesson builds on the previous knowledge without repeating what was already summarized.
 """
 
-lesson_generator_agent = ChatOpenAI(
+lesson_generator_agent = StructuredAgent(
+    'lesson_generator',
+    ChatOpenAI(
         model='gpt-4o-mini',
         temperature=0.1,
-    ).with_structured_output(Lesson)
+    ),
+    Lesson,
+    # Not cached, the prompt does not change when a lesson is regenerated so a cache hit would hand back the same lesson
+    fallbacks=[
+        ChatGroq(
+            model='llama-3.3-70b-versatile',
+            temperature=0.1,
+        ),
+    ],
+)
 
 
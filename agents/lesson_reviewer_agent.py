@@ -1,8 +1,13 @@
+import logging
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_groq import ChatGroq
+from langchain_openai import ChatOpenAI
+from agents.structured_agent import StructuredAgent
 from pydantic import BaseModel
 from typing import List
 
+logger = logging.getLogger(__name__)
+
 class LessonReview(BaseModel):
     approved: bool
     feedback: str
@@ -61,21 +66,31 @@ lesson_review_prompt_template = ChatPromptTemplate.from_messages(
     ]
 )
 
-lesson_reviewer_agent = ChatGroq(
-    model='llama-3.3-70b-versatile',
-    temperature=0.3
-).with_structured_output(LessonReview)
+lesson_reviewer_agent = StructuredAgent(
+    'lesson_reviewer',
+    ChatGroq(
+        model='llama-3.3-70b-versatile',
+        temperature=0.3
+    ),
+    LessonReview,
+    fallbacks=[
+        ChatOpenAI(
+            model='gpt-4o-mini',
+            temperature=0.3,
+        ),
+    ],
+)
 
-def review_lesson(current_lesson_title: str, lessons_in_concept: List[str], lesson_content: str) -> LessonReview or None:
+async def review_lesson(current_lesson_title: str, lessons_in_concept: List[str], lesson_content: str) -> LessonReview or None:
     try:
-        prompt = lesson_review_prompt_template.invoke({
+        prompt = await lesson_review_prompt_template.ainvoke({
             'current_lesson_title': current_lesson_title,
             'lessons_in_concept': lessons_in_concept,
             'lesson': lesson_content
         })
-        review: LessonReview = lesson_reviewer_agent.invoke(prompt)
+        review: LessonReview = await lesson_reviewer_agent.ainvoke(prompt)
 
         return review
-    except Exception as e:
-        print(f"Error reviewing lesson: {e}")
-        raise e
+    except Exception:
+        logger.exception("Error reviewing lesson")
+        raise
@@ -1,11 +1,17 @@
+import logging
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 from typing import List
 from dotenv import load_dotenv
+from langchain_groq import ChatGroq
 from langchain_openai import ChatOpenAI
+from agents.structured_agent import StructuredAgent
+from utils.log import summarize
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class Lesson(BaseModel):
     title: str = Field(description="Clear, descriptive lesson title")
     description: str = Field(description="Brief explanation of lesson content in one sentence.")
@@ -53,21 +59,32 @@ user_prompt_template = ChatPromptTemplate.from_messages(
 )
 
 
-lessons_planner_agent = ChatOpenAI(
+lessons_planner_agent = StructuredAgent(
+    'lessons_planner',
+    ChatOpenAI(
         model='gpt-4o-mini',
         temperature=0.1,
-    ).with_structured_output(LessonList)
+    ),
+    LessonList,
+    cache=True,
+    fallbacks=[
+        ChatGroq(
+            model='llama-3.3-70b-versatile',
+            temperature=0.1,
+        ),
+    ],
+)
 
 
-def plan_lessons(topic: str, section: str, concept: str):
+async def plan_lessons(topic: str, section: str, concept: str):
     try:
-        prompt = user_prompt_template.invoke({'topic': topic, 'section': section, 'concept': concept})
-        print('Planning lessons...')
-        lessons = lessons_planner_agent.invoke(prompt)
-        print(lessons.lessons)
+        prompt = await user_prompt_template.ainvoke({'topic': topic, 'section': section, 'concept': concept})
+        logger.info('Planning lessons', extra={'concept': concept})
+        lessons = await lessons_planner_agent.ainvoke(prompt)
+        logger.debug('Planned lessons: %s', summarize(lessons))
         return lessons.lessons
-    except Exception as e:
-        print(f"Error planning lessons: {e}")
+    except Exception:
+        logger.exception("Error planning lessons")
         raise
 
 
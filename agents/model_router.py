@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+import statistics
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
+from agents.scheduler import LLMQueueTimeoutError
+from utils.metrics import LLM_CIRCUIT_OPEN, LLM_ROUTING_EVENTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_HEDGING_ENABLED = os.getenv('LLM_HEDGING_ENABLED', 'true').lower() == 'true'
+# A hedge is sent once a call has run for the model's p95 latency, but never earlier than this
+LLM_HEDGE_MIN_SECONDS = float(os.getenv('LLM_HEDGE_MIN_SECONDS', '2'))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_LATENCY_WINDOW = int(os.getenv('LLM_LATENCY_WINDOW', '200'))
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv('LLM_BREAKER_FAILURE_THRESHOLD', '5'))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', '30'))
+
+T = TypeVar('T')
+
+
+def provider_of(llm: BaseChatModel) -> str:
+    """'openai' for ChatOpenAI, 'groq' for ChatGroq"""
+    return type(llm).__name__.removeprefix('Chat').lower()
+
+
+def model_name_of(llm: BaseChatModel) -> str:
+    return getattr(llm, 'model_name', None) or getattr(llm, 'model', '')
+
+
+@dataclass
+class ModelCandidate:
+    provider: str
+    model: str
+    runnable: Any
+
+    @classmethod
+    def for_llm(cls, llm: BaseChatModel, runnable) -> 'ModelCandidate':
+        return cls(provider_of(llm), model_name_of(llm), runnable)
+
+
+class CircuitBreaker:
+    """Stops sending calls to a provider after consecutive failures, lets a single probe through once it has cooled down"""
+
+    def __init__(self, provider: str, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD, reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self._probing or time.monotonic() - self.opened_at < self.reset_seconds:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("Circuit for %s closed", self.provider)
+            LLM_CIRCUIT_OPEN.labels(self.provider).set(0)
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self):
+        """The probe was cancelled before it could tell anything, the next call may probe instead"""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            if self.opened_at is None:
+                logger.warning("Circuit for %s opened after %s failures", self.provider, self.failures)
+            self.opened_at = time.monotonic()
+            self._probing = False
+            LLM_CIRCUIT_OPEN.labels(self.provider).set(1)
+
+
+class LatencyTracker:
+    """Recent successful call latencies of one model"""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW):
+        self.samples: deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return statistics.quantiles(self.samples, n=20)[-1]
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_latencies: dict[str, LatencyTracker] = {}
+
+
+def breaker_for(provider: str) -> CircuitBreaker:
+    if provider not in _breakers:
+        _breakers[provider] = CircuitBreaker(provider)
+    return _breakers[provider]
+
+
+def latency_for(model: str) -> LatencyTracker:
+    if model not in _latencies:
+        _latencies[model] = LatencyTracker()
+    return _latencies[model]
+
+
+def hedge_delay(model: str) -> Optional[float]:
+    """How long to wait for a call to this model before hedging it, None until its p95 is known"""
+    p95 = latency_for(model).p95()
+    return None if p95 is None else max(p95, LLM_HEDGE_MIN_SECONDS)
+
+
+class ModelRouter:
+    """Calls the first model of an ordered fallback list whose provider's circuit is closed, moves on to the next one
+    when it fails and sends a hedged call to the next one when it runs longer than its p95. The first valid result wins"""
+
+    def __init__(self, agent_name: str, hedging: bool = LLM_HEDGING_ENABLED):
+        self.agent_name = agent_name
+        self.hedging = hedging
+
+    async def invoke(self, candidates: list[ModelCandidate], attempt: Callable[[ModelCandidate], Awaitable[T]]) -> T:
+        running: dict[asyncio.Task, ModelCandidate] = {}
+        errors: list[BaseException] = []
+        remaining = iter(candidates)
+        hedging = self.hedging and len(candidates) > 1
+
+        def next_candidate() -> Optional[ModelCandidate]:
+            # Breakers are asked lazily, a half-open one hands out its single probe to the call that uses it
+            for candidate in remaining:
+                if breaker_for(candidate.provider).allow():
+                    return candidate
+            return None
+
+        def launch(candidate: Optional[ModelCandidate], event: Optional[str] = None) -> bool:
+            if candidate is None:
+                return False
+            if event:
+                logger.info("Sending %s call to %s", event, candidate.model, extra={'agent': self.agent_name})
+                LLM_ROUTING_EVENTS.labels(self.agent_name, candidate.model, event).inc()
+            running[asyncio.create_task(self._attempt(candidate, attempt))] = candidate
+            return True
+
+        # With every provider tripped the primary is tried anyway, failing fast would not help anyone
+        launch(next_candidate() or candidates[0])
+        try:
+            while running:
+                timeout = hedge_delay(next(iter(running.values())).model) if hedging and len(running) == 1 else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedging = launch(next_candidate(), 'hedge')
+                    continue
+
+                for task in done:
+                    candidate = running.pop(task)
+                    if task.exception() is None:
+                        if candidate is not candidates[0]:
+                            LLM_ROUTING_EVENTS.labels(self.agent_name, candidate.model, 'served').inc()
+                        return task.result()
+                    errors.append(task.exception())
+                    logger.warning("%s call to %s failed: %r", self.agent_name, candidate.model, task.exception())
+
+                if not running:
+                    launch(next_candidate(), 'fallback')
+            raise errors[-1]
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _attempt(self, candidate: ModelCandidate, attempt: Callable[[ModelCandidate], Awaitable[T]]) -> T:
+        breaker = breaker_for(candidate.provider)
+        started = time.perf_counter()
+        try:
+            result = await attempt(candidate)
+        except ValueError:
+            # Output that failed to parse or validate, the provider itself is fine
+            breaker.record_success()
+            raise
+        except (asyncio.CancelledError, LLMQueueTimeoutError):
+            breaker.release_probe()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        latency_for(candidate.model).observe(time.perf_counter() - started)
+        return result
@@ -1,5 +1,7 @@
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
+from langchain_openai import ChatOpenAI
+from agents.structured_agent import StructuredAgent
 from models.Roadmap import Roadmap
 
 load_dotenv()
@@ -103,7 +105,17 @@ generator_system_prompt = """
        - Aim for smooth, gradual learning progression from start to finish.
 """
 
-roadmap_generator_agent = ChatGroq(
-    model='llama-3.3-70b-versatile',
-    temperature=0.5
-).with_structured_output(Roadmap)
\ No newline at end of file
+roadmap_generator_agent = StructuredAgent(
+    'roadmap_generator',
+    ChatGroq(
+        model='llama-3.3-70b-versatile',
+        temperature=0.5
+    ),
+    Roadmap,
+    fallbacks=[
+        ChatOpenAI(
+            model='gpt-4o-mini',
+            temperature=0.5,
+        ),
+    ],
+)
\ No newline at end of file
@@ -1,4 +1,6 @@
 from langchain_groq import ChatGroq
+from langchain_openai import ChatOpenAI
+from agents.structured_agent import StructuredAgent
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
@@ -45,8 +47,18 @@ review_system_prompt = """
        - The roadmap may be about any topic, from technical subjects (e.g., JavaScript) to historical events (e.g., World War I).
 """
 
-roadmap_reviewer_agent = ChatGroq(
+roadmap_reviewer_agent = StructuredAgent(
+    'roadmap_reviewer',
+    ChatGroq(
         model='llama-3.3-70b-versatile',
         temperature=0.3,
-    ).with_structured_output(RoadmapReview)
+    ),
+    RoadmapReview,
+    fallbacks=[
+        ChatOpenAI(
+            model='gpt-4o-mini',
+            temperature=0.3,
+        ),
+    ],
+)
 
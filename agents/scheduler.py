@@ -0,0 +1,221 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+from dotenv import load_dotenv
+from utils.metrics import LLM_QUEUE_TIMEOUTS, LLM_QUEUE_WAIT
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+LLM_PRIORITY_INTERACTIVE = 0
+LLM_PRIORITY_NORMAL = 1
+LLM_PRIORITY_BACKGROUND = 2
+LLM_PRIORITY_NAMES = {LLM_PRIORITY_INTERACTIVE: 'interactive', LLM_PRIORITY_NORMAL: 'normal', LLM_PRIORITY_BACKGROUND: 'background'}
+
+# How long a call may wait for its turn before giving up
+LLM_QUEUE_DEADLINES = {
+    LLM_PRIORITY_INTERACTIVE: float(os.getenv('LLM_QUEUE_DEADLINE_INTERACTIVE_SECONDS', '20')),
+    LLM_PRIORITY_NORMAL: float(os.getenv('LLM_QUEUE_DEADLINE_NORMAL_SECONDS', '120')),
+    LLM_PRIORITY_BACKGROUND: float(os.getenv('LLM_QUEUE_DEADLINE_BACKGROUND_SECONDS', '600')),
+}
+
+# Provider limits are per process, split the account limits between the API and the workers
+_DEFAULT_LIMITS = {
+    'openai': {'requests': 500, 'tokens': 200_000},
+    'groq': {'requests': 30, 'tokens': 12_000},
+}
+LLM_MAX_IN_FLIGHT = int(os.getenv('LLM_MAX_IN_FLIGHT', '16'))
+# Bucket size in seconds of the per-minute rate, bounds how bursty the calls are
+LLM_RATE_BURST_SECONDS = float(os.getenv('LLM_RATE_BURST_SECONDS', '10'))
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv('LLM_COMPLETION_TOKENS_ESTIMATE', '1000'))
+# Pause after a provider answers 429 without a Retry-After header
+LLM_RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv('LLM_RATE_LIMIT_BACKOFF_SECONDS', '5'))
+
+llm_priority_var: ContextVar[int] = ContextVar('llm_priority', default=LLM_PRIORITY_NORMAL)
+
+
+class LLMQueueTimeoutError(Exception):
+    """Raised when a call could not be scheduled before its deadline"""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"{provider} is at its rate limit, try again in {round(retry_after)} seconds.")
+        self.retry_after = retry_after
+
+
+def _limit(provider: str, kind: str) -> float:
+    return float(os.getenv(f"{provider.upper()}_{kind.upper()}_PER_MINUTE", str(_DEFAULT_LIMITS.get(provider, {}).get(kind, 0))))
+
+
+class TokenBucket:
+    """Refills at a per-minute rate. An amount larger than the bucket is let through once the bucket is full"""
+
+    def __init__(self, per_minute: float, burst_seconds: float = LLM_RATE_BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * burst_seconds, 1)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def refund(self, amount: float):
+        """Negative amounts charge the difference when a call used more than estimated"""
+        self.level = min(self.capacity, self.level + amount)
+
+    def drain(self):
+        self.level = min(self.level, 0)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    deadline: float
+    seq: int
+    tokens: int = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class Permit:
+    def __init__(self, scheduler: 'ProviderScheduler', tokens: int):
+        self.scheduler = scheduler
+        self.tokens = tokens
+
+    def settle(self, used_tokens: int):
+        """Corrects the estimate the call was charged with once the provider reported its usage"""
+        self.scheduler.tokens.refund(self.tokens - used_tokens)
+        self.tokens = used_tokens
+
+
+class ProviderScheduler:
+    """Hands out turns for calls to one provider in priority order, within its request and token rates
+    and a bound on calls in flight. Calls queue until their deadline instead of running into 429s"""
+
+    def __init__(self, provider: str, requests_per_minute: float, tokens_per_minute: float, max_in_flight: int = LLM_MAX_IN_FLIGHT):
+        self.provider = provider
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._waiters: list[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.future.done())
+
+    @contextlib.asynccontextmanager
+    async def slot(self, tokens: int, priority: Optional[int] = None):
+        permit = await self.acquire(tokens, priority)
+        try:
+            yield permit
+        finally:
+            self.in_flight -= 1
+            self._dispatch()
+
+    async def acquire(self, tokens: int, priority: Optional[int] = None) -> Permit:
+        priority = llm_priority_var.get() if priority is None else priority
+        started = time.monotonic()
+        deadline = started + LLM_QUEUE_DEADLINES[priority]
+        waiter = _Waiter(priority, deadline, next(self._seq), tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        self._dispatch()
+
+        def granted() -> bool:
+            # The turn can be handed out in the same loop iteration the deadline or a cancellation hits
+            return waiter.future.done() and not waiter.future.cancelled()
+
+        try:
+            await asyncio.wait_for(waiter.future, timeout=deadline - started)
+        except TimeoutError:
+            if not granted():
+                LLM_QUEUE_TIMEOUTS.labels(self.provider, LLM_PRIORITY_NAMES[priority]).inc()
+                logger.warning("Gave up waiting for a %s call slot", self.provider, extra={'priority': LLM_PRIORITY_NAMES[priority], 'queued': self.queued})
+                raise LLMQueueTimeoutError(self.provider, self._retry_after(tokens)) from None
+        except asyncio.CancelledError:
+            if granted():
+                self.in_flight -= 1
+                self._dispatch()
+            raise
+
+        LLM_QUEUE_WAIT.labels(self.provider, LLM_PRIORITY_NAMES[priority]).observe(time.monotonic() - started)
+        return Permit(self, tokens)
+
+    def rate_limited(self, retry_after: Optional[float] = None):
+        """The provider answered 429, stops handing out turns for a while"""
+        pause = retry_after if retry_after is not None else LLM_RATE_LIMIT_BACKOFF_SECONDS
+        logger.warning("%s rate limited us, pausing calls for %ss", self.provider, pause)
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        self.requests.drain()
+        self._dispatch()
+
+    def _retry_after(self, tokens: int) -> float:
+        now = time.monotonic()
+        return max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now), 1.0)
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        now = time.monotonic()
+        while self._waiters and self.in_flight < self.max_in_flight:
+            waiter = self._waiters[0]
+            if waiter.future.done():
+                # Timed out or cancelled
+                heapq.heappop(self._waiters)
+                continue
+            wait = max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(waiter.tokens, now))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            self.in_flight += 1
+            waiter.future.set_result(None)
+
+
+_schedulers: dict[str, ProviderScheduler] = {}
+
+
+def scheduler_for(provider: str) -> ProviderScheduler:
+    if provider not in _schedulers:
+        _schedulers[provider] = ProviderScheduler(provider, _limit(provider, 'requests'), _limit(provider, 'tokens'))
+    return _schedulers[provider]
+
+
+def estimate_tokens(prompt_tokens: int) -> int:
+    return prompt_tokens + LLM_COMPLETION_TOKENS_ESTIMATE
+
+
+def retry_after_of(error: Exception) -> Optional[float]:
+    """Seconds from the Retry-After header of a 429 response, None when the error is not a rate limit"""
+    if getattr(error, 'status_code', None) != 429:
+        return None
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return LLM_RATE_LIMIT_BACKOFF_SECONDS
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import time
+import sentry_sdk
+from typing import Optional, Sequence, Type
+from dotenv import load_dotenv
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.prompt_values import PromptValue
+from pydantic import BaseModel
+from agents.cassettes import CassetteStore, cassettes
+from agents.model_router import ModelCandidate, ModelRouter, model_name_of
+from agents.scheduler import estimate_tokens, retry_after_of, scheduler_for
+from cache.llm_cache import LLMCache, llm_cache, make_cache_key
+from utils.metrics import LLM_CALL_LATENCY, LLM_TOKENS
+from utils.tokens import count_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Follow-up calls that show the model its invalid output and the validation error
+LLM_REPAIR_ATTEMPTS = int(os.getenv('LLM_REPAIR_ATTEMPTS', '1'))
+
+REPAIR_PROMPT = """Your previous reply could not be used, it failed validation against the required output schema:
+{error}
+
+Reply again with the complete output, corrected so that it matches the schema."""
+
+
+class StructuredOutputError(ValueError):
+    """Raised when the model's reply does not parse into the agent's schema"""
+
+    def __init__(self, agent_name: str, error, raw_text: str):
+        super().__init__(f"{agent_name} returned invalid structured output: {error}")
+        self.error = error
+        self.raw_text = raw_text
+
+
+def _raw_text(raw_message) -> str:
+    """What the model replied with, whether it came back as a tool call or as plain content"""
+    if raw_message is None:
+        return ''
+    if getattr(raw_message, 'tool_calls', None):
+        return json.dumps(raw_message.tool_calls[0]['args'])
+    if getattr(raw_message, 'invalid_tool_calls', None):
+        return raw_message.invalid_tool_calls[0].get('args') or ''
+    content = raw_message.content
+    return content if isinstance(content, str) else json.dumps(content)
+
+
+def _to_messages(prompt: PromptValue | list[BaseMessage]) -> list[BaseMessage]:
+    return prompt.to_messages() if isinstance(prompt, PromptValue) else list(prompt)
+
+
+class StructuredAgent:
+    """Chat model bound to a structured output schema, every agent call in the app goes through here"""
+
+    def __init__(self, name: str, llm: BaseChatModel, schema: Type[BaseModel], cache: bool = False, response_cache: LLMCache = llm_cache, cassette_store: CassetteStore = cassettes, fallbacks: Sequence[BaseChatModel] = ()):
+        self.name = name
+        self.llm = llm
+        self.schema = schema
+        self.cache = response_cache if cache else None
+        self.cassettes = cassette_store
+        # include_raw keeps the provider message around for its token usage
+        self.runnable = llm.with_structured_output(schema, include_raw=True)
+        # Tried in order when the primary model fails, and raced against it when it is slow
+        self.fallbacks = [ModelCandidate.for_llm(fallback, fallback.with_structured_output(schema, include_raw=True)) for fallback in fallbacks]
+        self.router = ModelRouter(name)
+        self.repair_attempts = LLM_REPAIR_ATTEMPTS
+        self._schema_json = schema.model_json_schema()
+
+    @property
+    def model_name(self) -> str:
+        return model_name_of(self.llm)
+
+    def candidates(self) -> list[ModelCandidate]:
+        return [ModelCandidate.for_llm(self.llm, self.runnable), *self.fallbacks]
+
+    @staticmethod
+    def _serialize_messages(messages: list[BaseMessage]) -> list[dict]:
+        return [{'type': message.type, 'content': message.content} for message in messages]
+
+    def cache_key(self, messages: list[BaseMessage]) -> str:
+        return make_cache_key(
+            model=self.model_name,
+            temperature=getattr(self.llm, 'temperature', None),
+            messages=self._serialize_messages(messages),
+            schema=self._schema_json,
+        )
+
+    def _observe(self, started: float, outcome: str, model: str):
+        elapsed = time.perf_counter() - started
+        LLM_CALL_LATENCY.labels(self.name, model, outcome).observe(elapsed)
+        logger.debug("LLM call finished", extra={'agent': self.name, 'model': model, 'outcome': outcome, 'latency_ms': round(elapsed * 1000)})
+
+    def _record_usage(self, raw_message, model: str) -> Optional[int]:
+        """Returns the total tokens the call used, None when the provider did not report them"""
+        usage = getattr(raw_message, 'usage_metadata', None)
+        if not usage:
+            return None
+        LLM_TOKENS.labels(self.name, model, 'prompt').inc(usage.get('input_tokens', 0))
+        LLM_TOKENS.labels(self.name, model, 'completion').inc(usage.get('output_tokens', 0))
+        return usage.get('input_tokens', 0) + usage.get('output_tokens', 0)
+
+    async def _call_candidate(self, candidate: ModelCandidate, messages: list[BaseMessage], config=None) -> tuple[BaseModel, str]:
+        scheduler = scheduler_for(candidate.provider)
+        prompt_tokens = count_tokens(''.join(str(message.content) for message in messages))
+        async with scheduler.slot(estimate_tokens(prompt_tokens)) as permit:
+            started = time.perf_counter()
+            try:
+                output = await candidate.runnable.ainvoke(messages, config=config)
+            except Exception as e:
+                self._observe(started, 'error', candidate.model)
+                retry_after = retry_after_of(e)
+                if retry_after is not None:
+                    scheduler.rate_limited(retry_after)
+                raise
+
+            used_tokens = self._record_usage(output['raw'], candidate.model)
+            if used_tokens is not None:
+                permit.settle(used_tokens)
+
+        result = output['parsed']
+        if output['parsing_error'] is not None or result is None:
+            self._observe(started, 'invalid', candidate.model)
+            error = output['parsing_error'] or 'no structured output'
+            raise StructuredOutputError(self.name, error, _raw_text(output['raw'])) from output['parsing_error']
+        self._observe(started, 'success', candidate.model)
+        return result, candidate.model
+
+    async def _call_model(self, messages: list[BaseMessage], key: str, config=None) -> BaseModel:
+        started = time.perf_counter()
+        if self.cassettes.mode == 'replay':
+            result = self.schema.model_validate(await self.cassettes.replay(self.name, key))
+            self._observe(started, 'replay', self.model_name)
+            return result
+
+        attempt_messages = messages
+        for repair in range(self.repair_attempts + 1):
+            try:
+                result, model = await self.router.invoke(
+                    self.candidates(),
+                    lambda candidate, attempt_messages=attempt_messages: self._call_candidate(candidate, attempt_messages, config)
+                )
+                break
+            except StructuredOutputError as e:
+                if repair == self.repair_attempts:
+                    raise
+                logger.warning("Asking %s to repair its invalid output", self.name, extra={'error': str(e.error)})
+                attempt_messages = [*messages, AIMessage(content=e.raw_text), HumanMessage(content=REPAIR_PROMPT.format(error=e.error))]
+
+        if self.cassettes.mode == 'record':
+            await self.cassettes.record(
+                self.name,
+                key,
+                model=model,
+                messages=self._serialize_messages(messages),
+                output=result.model_dump(mode='json'),
+                latency_ms=(time.perf_counter() - started) * 1000,
+            )
+        return result
+
+    async def ainvoke(self, prompt: PromptValue | list[BaseMessage], config=None) -> BaseModel:
+        with sentry_sdk.start_span(op='agent.invoke', name=self.name) as span:
+            span.set_data('model', self.model_name)
+            return await self._invoke(_to_messages(prompt), span, config)
+
+    async def _invoke(self, messages: list[BaseMessage], span, config=None) -> BaseModel:
+        key = self.cache_key(messages) if self.cache or self.cassettes.enabled else None
+
+        if self.cache:
+            cached = await self.cache.get(self.name, key)
+            span.set_data('cache_hit', cached is not None)
+            if cached is not None:
+                logger.debug("LLM cache hit", extra={'agent': self.name})
+                return self.schema.model_validate(cached)
+
+        result = await self._call_model(messages, key, config)
+
+        if self.cache and result is not None:
+            await self.cache.set(self.name, key, result.model_dump(mode='json'))
+        return result
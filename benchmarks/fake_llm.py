@@ -0,0 +1,121 @@
+import asyncio
+import random
+from typing import Type
+from langchain_core.messages import AIMessage
+from pydantic import BaseModel
+from agents.exercise_checker_agent import Answer, AnswerList
+from agents.lesson_reviewer_agent import LessonReview
+from agents.lessons_planner_agent import LessonList
+from agents.roadmap_reviewer_agent import RoadmapReview
+from agents.structured_agent import StructuredAgent
+from models.Lesson import Lesson
+from models.Roadmap import Roadmap
+
+LOREM = (
+    "Closures let a function remember the variables of the scope it was created in. "
+    "This lesson walks through how that works, why it matters and where it shows up in everyday code. "
+)
+
+
+def _roadmap() -> dict:
+    return {
+        'topic': 'Benchmarking',
+        'sections': [
+            {
+                'title': f'Section {i + 1}',
+                'description': f'What the learner achieves in section {i + 1}.',
+                'concepts': [
+                    {'title': f'Concept {i + 1}.{j + 1}', 'description': 'A short summary of the concept.'}
+                    for j in range(6)
+                ]
+            }
+            for i in range(8)
+        ]
+    }
+
+
+def _lesson() -> dict:
+    return {
+        'content': "## Lesson\n\n" + LOREM * 40 + "\n```javascript\nconst add = a => b => a + b;\n```\n",
+        'exercises': [
+            {'type': 'mcq', 'exercise': {'question': f'Question {i + 1}?', 'answer_options': ['A', 'B', 'C', 'D'], 'answer_index': i % 4}}
+            for i in range(3)
+        ] + [{'type': 'question', 'exercise': {'question': 'Explain a closure in your own words.'}}],
+        'summary': 'The learner understands closures.',
+        'is_final': False
+    }
+
+
+FAKE_OUTPUTS = {
+    Roadmap: _roadmap,
+    RoadmapReview: lambda: {'approved': True, 'feedback': ''},
+    LessonList: lambda: {'lessons': [
+        {'title': f'Lesson {i + 1}', 'description': 'One sentence about the lesson.', 'learning_objectives': ['Objective A', 'Objective B']}
+        for i in range(4)
+    ]},
+    Lesson: _lesson,
+    LessonReview: lambda: {'approved': True, 'feedback': 'Looks good.'},
+    Answer: lambda: {'is_correct': True, 'additional_explanation': 'You got it. ' + LOREM},
+    AnswerList: lambda: {'answers': [
+        {'exercise_index': i, 'is_correct': True, 'additional_explanation': 'You got it. ' + LOREM}
+        for i in range(4)
+    ]},
+}
+
+
+class FakeStructuredModel:
+    """Stands in for `llm.with_structured_output(schema, include_raw=True)`, answers with a fixed object after a simulated latency"""
+
+    def __init__(self, schema: Type[BaseModel], latency_ms: float, jitter_ms: float = 0.0, seed: int = 0):
+        self.schema = schema
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    async def ainvoke(self, messages, config=None) -> dict:
+        self.calls += 1
+        delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        await asyncio.sleep(max(delay, 0) / 1000)
+
+        parsed = self.schema.model_validate(FAKE_OUTPUTS[self.schema]())
+        prompt_tokens = sum(len(str(message.content)) for message in messages) // 4
+        completion_tokens = len(parsed.model_dump_json()) // 4
+        raw = AIMessage(content='', usage_metadata={
+            'input_tokens': prompt_tokens,
+            'output_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        })
+        return {'raw': raw, 'parsed': parsed, 'parsing_error': None}
+
+
+def all_agents() -> list[StructuredAgent]:
+    from agents.exercise_checker_agent import batch_exercise_checker, exercise_checker
+    from agents.lesson_generator_agent import lesson_generator_agent
+    from agents.lesson_reviewer_agent import lesson_reviewer_agent
+    from agents.lessons_planner_agent import lessons_planner_agent
+    from agents.roadmap_generator_agent import roadmap_generator_agent
+    from agents.roadmap_reviewer_agent import roadmap_reviewer_agent
+
+    return [
+        exercise_checker,
+        batch_exercise_checker,
+        lesson_generator_agent,
+        lesson_reviewer_agent,
+        lessons_planner_agent,
+        roadmap_generator_agent,
+        roadmap_reviewer_agent,
+    ]
+
+
+def install_fake_llms(latency_ms: float, jitter_ms: float = 0.0, keep_cache: bool = False) -> dict[str, FakeStructuredModel]:
+    """Swaps the model behind every agent for a fake, returns the fakes by agent name"""
+    fakes = {}
+    for seed, agent in enumerate(all_agents()):
+        fakes[agent.name] = FakeStructuredModel(agent.schema, latency_ms, jitter_ms, seed)
+        agent.runnable = fakes[agent.name]
+        for fallback in agent.fallbacks:
+            fallback.runnable = fakes[agent.name]
+        if not keep_cache:
+            agent.cache = None
+    return fakes
@@ -0,0 +1,91 @@
+"""In-memory stand-in for pymongo's AsyncMongoClient, backed by mongomock.
+
+Only the parts of the async API the app uses are adapted, everything else is passed through to mongomock.
+"""
+import mongomock
+
+
+class AsyncCursorStandIn:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, limit: int):
+        self._cursor = self._cursor.limit(limit)
+        return self
+
+    def skip(self, skip: int):
+        self._cursor = self._cursor.skip(skip)
+        return self
+
+    async def to_list(self, length: int = None):
+        documents = list(self._cursor)
+        return documents[:length] if length is not None else documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self._cursor:
+            yield document
+
+
+class AsyncCollectionStandIn:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursorStandIn(self._collection.find(*args, **kwargs))
+
+    async def aggregate(self, pipeline, **kwargs):
+        # mongomock has no $indexStats, report every index as unused
+        if pipeline and '$indexStats' in pipeline[0]:
+            return AsyncCursorStandIn(iter([
+                {'name': name, 'accesses': {'ops': 0}} for name in self._collection.index_information()
+            ]))
+        return AsyncCursorStandIn(self._collection.aggregate(pipeline, **kwargs))
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        async def method(*args, **kwargs):
+            return attribute(*args, **kwargs)
+
+        return method
+
+
+class AsyncDatabaseStandIn:
+    def __init__(self, database):
+        self._database = database
+
+    def get_collection(self, name: str, **_kwargs):
+        return AsyncCollectionStandIn(self._database.get_collection(name))
+
+    def __getitem__(self, name: str):
+        return self.get_collection(name)
+
+    async def command(self, command, *_args, **_kwargs):
+        return {'ok': 1.0}
+
+    async def list_collection_names(self):
+        return self._database.list_collection_names()
+
+
+class AsyncMongoClientStandIn:
+    def __init__(self):
+        self._client = mongomock.MongoClient()
+
+    def get_database(self, name: str):
+        return AsyncDatabaseStandIn(self._client.get_database(name))
+
+    @property
+    def admin(self):
+        return self.get_database('admin')
+
+    async def close(self):
+        self._client.close()
@@ -0,0 +1,245 @@
+"""Offline load test of the API with fake LLMs and an in-memory (or local) MongoDB.
+
+    python -m benchmarks.run --concurrency 20 --requests 200 --llm-latency-ms 800
+    python -m benchmarks.run --mongo-uri mongodb://localhost:27017 --scenarios check-answer roadmaps
+    python -m benchmarks.run --cassettes cassettes --cassette-speed 1
+
+With --cassettes, agent calls are served from recordings made with LLM_CASSETTE_MODE=record instead of fakes,
+with their recorded latencies.
+
+No OpenAI, Groq or Atlas access is needed. Latencies are measured end to end through the ASGI app,
+for job based endpoints both until the job is accepted and until it has finished.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from dataclasses import dataclass, field
+
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+os.environ.setdefault('GROQ_API_KEY', 'benchmark')
+os.environ['SENTRY_DSN'] = ''
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+# The fake models have no rate limits, 0 turns the scheduler's buckets off
+for limit in ('OPENAI_REQUESTS_PER_MINUTE', 'OPENAI_TOKENS_PER_MINUTE', 'GROQ_REQUESTS_PER_MINUTE', 'GROQ_TOKENS_PER_MINUTE'):
+    os.environ.setdefault(limit, '0')
+
+import httpx
+
+import db.mongo as mongo
+from agents.cassettes import cassettes
+from benchmarks.fake_llm import all_agents, install_fake_llms
+from benchmarks.mongo_stand_in import AsyncMongoClientStandIn
+
+JOB_POLL_INTERVAL_SECONDS = 0.02
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    wall_time: float = 0.0
+
+    def percentile(self, p: int) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return statistics.quantiles(self.latencies, n=100, method='inclusive')[p - 1]
+
+    @property
+    def requests_per_second(self) -> float:
+        return len(self.latencies) / self.wall_time if self.wall_time else 0.0
+
+
+class LoopLagProbe:
+    """Measures how late the event loop wakes up, blocking calls on the loop show up as lag"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.max_lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.max_lag = max(self.max_lag, time.perf_counter() - started - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def wait_for_job(client: httpx.AsyncClient, job_id: str) -> bool:
+    while True:
+        job = (await client.get(f'/jobs/{job_id}')).json()
+        if job['status'] in ('succeeded', 'failed'):
+            return job['status'] == 'succeeded'
+        await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS)
+
+
+async def seed(client: httpx.AsyncClient) -> dict:
+    """Creates one roadmap with a generated first lesson to run the read and check scenarios against"""
+    response = await client.post('/generate-roadmap', json={'topic': 'Benchmarking'})
+    job_id = response.json()['jobId']
+    await wait_for_job(client, job_id)
+    roadmap_id = (await client.get(f'/jobs/{job_id}')).json()['result']['roadmapId']
+
+    roadmap = (await client.get(f'/roadmaps/{roadmap_id}')).json()
+    section = roadmap['sections'][0]
+    concept = section['concepts'][0]
+    lesson = concept['lessons'][0]
+
+    lesson_request = {
+        'roadmapId': roadmap_id,
+        'roadmapTitle': roadmap['topic'],
+        'sectionTitle': section['title'],
+        'conceptTitle': concept['title'],
+        'conceptId': concept['_id'],
+        'lessonId': lesson['_id'],
+    }
+    response = await client.post('/lesson', json=lesson_request)
+    await wait_for_job(client, response.json()['jobId'])
+    return {'lesson_request': lesson_request}
+
+
+def build_scenarios(fixtures: dict) -> dict:
+    async def roadmaps(client):
+        return (await client.get('/roadmaps', params={'limit': 20})).status_code == 200
+
+    async def check_answer(client):
+        response = await client.post('/check-answer', json={
+            'question': 'What is a closure?',
+            'answer': 'A function that remembers its scope',
+            'lessonContent': 'Closures let a function remember the variables of the scope it was created in.',
+        })
+        return response.status_code == 200
+
+    async def check_answers(client):
+        response = await client.post('/check-answers', json={
+            'lessonId': fixtures['lesson_request']['lessonId'],
+            'answers': [{'exerciseIndex': i, 'answer': 0} for i in range(3)] + [{'exerciseIndex': 3, 'answer': 'A function that remembers its scope'}],
+        })
+        return response.status_code == 200
+
+    async def generate_roadmap_accepted(client):
+        return (await client.post('/generate-roadmap', json={'topic': 'Benchmarking'})).status_code == 202
+
+    async def generate_roadmap(client):
+        response = await client.post('/generate-roadmap', json={'topic': 'Benchmarking'})
+        return response.status_code == 202 and await wait_for_job(client, response.json()['jobId'])
+
+    async def lesson_accepted(client):
+        return (await client.post('/lesson', json=fixtures['lesson_request'])).status_code == 202
+
+    async def lesson(client):
+        response = await client.post('/lesson', json=fixtures['lesson_request'])
+        return response.status_code == 202 and await wait_for_job(client, response.json()['jobId'])
+
+    return {
+        'roadmaps': roadmaps,
+        'check-answer': check_answer,
+        'check-answers': check_answers,
+        'generate-roadmap:accepted': generate_roadmap_accepted,
+        'generate-roadmap': generate_roadmap,
+        'lesson:accepted': lesson_accepted,
+        'lesson': lesson,
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, scenario, concurrency: int, total: int) -> ScenarioResult:
+    result = ScenarioResult(name)
+    remaining = iter(range(total))
+
+    async def user():
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                ok = await scenario(client)
+            except Exception as e:
+                print(f"{name}: {e}")
+                ok = False
+            if ok:
+                result.latencies.append(time.perf_counter() - started)
+            else:
+                result.errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    result.wall_time = time.perf_counter() - started
+    return result
+
+
+def print_report(results: list[ScenarioResult], max_loop_lag: float, args):
+    llm = f"cassettes from {args.cassettes}" if args.cassettes else f"fake, {args.llm_latency_ms}ms"
+    print(f"\nconcurrency={args.concurrency} requests={args.requests} llm={llm} "
+          f"mongo={'local mongod' if args.mongo_uri else 'mongomock'}\n")
+    header = f"{'scenario':<28}{'ok':>6}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(f"{result.name:<28}{len(result.latencies):>6}{result.errors:>6}"
+              f"{result.percentile(50) * 1000:>10.1f}{result.percentile(95) * 1000:>10.1f}"
+              f"{result.percentile(99) * 1000:>10.1f}{result.requests_per_second:>10.1f}")
+    print(f"\nmax event loop lag: {max_loop_lag * 1000:.1f} ms")
+
+
+async def main(args):
+    if args.mongo_uri:
+        mongo.MONGO_URI = args.mongo_uri
+        mongo.MONGO_DB_NAME = args.mongo_db
+    else:
+        mongo.create_client = AsyncMongoClientStandIn
+
+    if args.cassettes:
+        cassettes.configure('replay', args.cassettes, args.cassette_match, args.cassette_speed)
+        if not args.keep_cache:
+            for agent in all_agents():
+                agent.cache = None
+    else:
+        install_fake_llms(args.llm_latency_ms, args.llm_jitter_ms, keep_cache=args.keep_cache)
+
+    from main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=None) as client:
+            fixtures = await seed(client)
+            scenarios = build_scenarios(fixtures)
+
+            probe = LoopLagProbe()
+            probe.start()
+            results = []
+            for name in args.scenarios:
+                results.append(await run_scenario(client, name, scenarios[name], args.concurrency, args.requests))
+            await probe.stop()
+
+    print_report(results, probe.max_lag, args)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=100, help='requests per scenario')
+    parser.add_argument('--llm-latency-ms', type=float, default=500)
+    parser.add_argument('--llm-jitter-ms', type=float, default=0)
+    parser.add_argument('--keep-cache', action='store_true', help='leave the LLM response cache on')
+    parser.add_argument('--cassettes', help='replay recorded LLM calls from this directory instead of using fakes')
+    parser.add_argument('--cassette-match', choices=['exact', 'sequence'], default='sequence')
+    parser.add_argument('--cassette-speed', type=float, default=1.0, help='0 replays instantly')
+    parser.add_argument('--mongo-uri', help='use a local mongod instead of mongomock')
+    parser.add_argument('--mongo-db', default='benchmark')
+    parser.add_argument(
+        '--scenarios',
+        nargs='+',
+        default=['roadmaps', 'check-answer', 'check-answers', 'generate-roadmap:accepted', 'generate-roadmap', 'lesson:accepted', 'lesson'],
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
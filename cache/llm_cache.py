@@ -0,0 +1,149 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+from collections import Counter, OrderedDict
+from datetime import timezone
+from typing import Optional, Protocol
+from dotenv import load_dotenv
+from utils.metrics import LLM_CACHE_LOOKUPS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_MONGO_ENABLED = os.getenv('LLM_CACHE_MONGO_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_LRU_SIZE = int(os.getenv('LLM_CACHE_LRU_SIZE', '1024'))
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+
+LLM_CACHE_COLLECTION = 'llm_cache'
+
+
+def make_cache_key(model: str, temperature: Optional[float], messages: list[dict], schema: dict) -> str:
+    """Content address of an LLM call, identical inputs always map to the same key"""
+    payload = json.dumps(
+        {'model': model, 'temperature': temperature, 'messages': messages, 'schema': schema},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(timezone.utc)
+
+
+class CacheTier(Protocol):
+    name: str
+
+    async def get(self, key: str) -> Optional[dict]: ...
+
+    async def set(self, key: str, namespace: str, value: dict): ...
+
+
+class LRUCacheTier:
+    """In-process tier, evicts the least recently used entry once max_entries is reached"""
+    name = 'memory'
+
+    def __init__(self, max_entries: int = LLM_CACHE_LRU_SIZE, ttl_seconds: int = LLM_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = datetime.timedelta(seconds=ttl_seconds)
+        self._entries: OrderedDict[str, tuple[datetime.datetime, dict]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= _now():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, namespace: str, value: dict):
+        self._entries[key] = (_now() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class MongoCacheTier:
+    """Shared tier in the llm_cache collection, expired documents are removed by its TTL index"""
+    name = 'mongo'
+
+    def __init__(self, ttl_seconds: int = LLM_CACHE_TTL_SECONDS):
+        self.ttl = datetime.timedelta(seconds=ttl_seconds)
+
+    def _collection(self):
+        from db.mongo import get_database
+        return get_database().get_collection(LLM_CACHE_COLLECTION)
+
+    async def get(self, key: str) -> Optional[dict]:
+        doc = await self._collection().find_one({'_id': key, 'expiresAt': {'$gt': _now()}}, {'value': 1})
+        return doc['value'] if doc else None
+
+    async def set(self, key: str, namespace: str, value: dict):
+        now = _now()
+        await self._collection().update_one(
+            {'_id': key},
+            {'$set': {'namespace': namespace, 'value': value, 'createdAt': now, 'expiresAt': now + self.ttl}},
+            upsert=True
+        )
+
+
+class LLMCache:
+    """Looks a key up tier by tier and backfills the faster tiers on a hit"""
+
+    def __init__(self, tiers: list[CacheTier]):
+        self.tiers = tiers
+        self.counters: Counter[tuple[str, str, str]] = Counter()
+
+    async def get(self, namespace: str, key: str) -> Optional[dict]:
+        for i, tier in enumerate(self.tiers):
+            try:
+                value = await tier.get(key)
+            except Exception as e:
+                logger.warning("Error reading %s LLM cache: %s", tier.name, e)
+                value = None
+
+            outcome = 'miss' if value is None else 'hit'
+            self.counters[(namespace, tier.name, outcome)] += 1
+            LLM_CACHE_LOOKUPS.labels(namespace, tier.name, outcome).inc()
+            if value is None:
+                continue
+
+            for faster_tier in self.tiers[:i]:
+                await self._set_tier(faster_tier, key, namespace, value)
+            return value
+        return None
+
+    async def set(self, namespace: str, key: str, value: dict):
+        for tier in self.tiers:
+            await self._set_tier(tier, key, namespace, value)
+
+    @staticmethod
+    async def _set_tier(tier: CacheTier, key: str, namespace: str, value: dict):
+        try:
+            await tier.set(key, namespace, value)
+        except Exception as e:
+            logger.warning("Error writing %s LLM cache: %s", tier.name, e)
+
+    def stats(self) -> dict:
+        stats: dict = {}
+        for (namespace, tier, outcome), count in self.counters.items():
+            stats.setdefault(namespace, {}).setdefault(tier, {'hit': 0, 'miss': 0})[outcome] = count
+        return stats
+
+
+def _default_tiers() -> list[CacheTier]:
+    tiers: list[CacheTier] = [LRUCacheTier()]
+    if LLM_CACHE_MONGO_ENABLED:
+        tiers.append(MongoCacheTier())
+    return tiers
+
+
+llm_cache = LLMCache(_default_tiers() if LLM_CACHE_ENABLED else [])
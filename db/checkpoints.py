@@ -0,0 +1,121 @@
+import datetime
+import os
+from datetime import timezone
+from typing import Any, AsyncIterator, Optional, Sequence
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from pymongo.asynchronous.database import AsyncDatabase
+
+load_dotenv()
+
+CHECKPOINTS_COLLECTION = 'graph_checkpoints'
+CHECKPOINT_WRITES_COLLECTION = 'graph_checkpoint_writes'
+# Checkpoints of jobs that never completed are removed after this long
+GRAPH_CHECKPOINT_TTL_SECONDS = int(os.getenv('GRAPH_CHECKPOINT_TTL_SECONDS', str(24 * 3600)))
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(timezone.utc)
+
+
+class MongoCheckpointSaver(BaseCheckpointSaver[int]):
+    """LangGraph checkpointer storing each checkpoint, channel values included, as one document.
+    Only the async interface is implemented, the graphs are always run with ainvoke/astream"""
+
+    def __init__(self, db: AsyncDatabase, serde=None):
+        super().__init__(serde=serde)
+        self.checkpoints = db.get_collection(CHECKPOINTS_COLLECTION)
+        self.writes = db.get_collection(CHECKPOINT_WRITES_COLLECTION)
+
+    def _dump(self, value: Any) -> dict:
+        type_, data = self.serde.dumps_typed(value)
+        return {'type': type_, 'data': data}
+
+    def _load(self, stored: dict) -> Any:
+        return self.serde.loads_typed((stored['type'], stored['data']))
+
+    async def _to_tuple(self, doc: dict) -> CheckpointTuple:
+        key = {'thread_id': doc['thread_id'], 'checkpoint_ns': doc['checkpoint_ns'], 'checkpoint_id': doc['checkpoint_id']}
+        writes = await self.writes.find(key).sort([('task_id', 1), ('idx', 1)]).to_list()
+        parent_id = doc.get('parent_checkpoint_id')
+        return CheckpointTuple(
+            config={'configurable': key},
+            checkpoint=self._load(doc['checkpoint']),
+            metadata=self._load(doc['metadata']),
+            parent_config={'configurable': {**key, 'checkpoint_id': parent_id}} if parent_id else None,
+            pending_writes=[(write['task_id'], write['channel'], self._load(write['value'])) for write in writes],
+        )
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        configurable = config['configurable']
+        query = {'thread_id': configurable['thread_id'], 'checkpoint_ns': configurable.get('checkpoint_ns', '')}
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id:
+            query['checkpoint_id'] = checkpoint_id
+        # Checkpoint ids sort in the order they were created
+        doc = await self.checkpoints.find_one(query, sort=[('checkpoint_id', -1)])
+        return await self._to_tuple(doc) if doc else None
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        query = {}
+        if config:
+            query['thread_id'] = config['configurable']['thread_id']
+            if 'checkpoint_ns' in config['configurable']:
+                query['checkpoint_ns'] = config['configurable']['checkpoint_ns']
+        if before and get_checkpoint_id(before):
+            query['checkpoint_id'] = {'$lt': get_checkpoint_id(before)}
+
+        returned = 0
+        async for doc in self.checkpoints.find(query).sort('checkpoint_id', -1):
+            checkpoint_tuple = await self._to_tuple(doc)
+            if filter and any(checkpoint_tuple.metadata.get(key) != value for key, value in filter.items()):
+                continue
+            yield checkpoint_tuple
+            returned += 1
+            if limit is not None and returned >= limit:
+                return
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        configurable = config['configurable']
+        key = {'thread_id': configurable['thread_id'], 'checkpoint_ns': configurable.get('checkpoint_ns', ''), 'checkpoint_id': checkpoint['id']}
+        await self.checkpoints.update_one(
+            key,
+            {'$set': {
+                'parent_checkpoint_id': configurable.get('checkpoint_id'),
+                'checkpoint': self._dump(checkpoint),
+                'metadata': self._dump(get_checkpoint_metadata(config, metadata)),
+                'createdAt': _now(),
+            }},
+            upsert=True
+        )
+        return {'configurable': key}
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = '') -> None:
+        configurable = config['configurable']
+        key = {'thread_id': configurable['thread_id'], 'checkpoint_ns': configurable.get('checkpoint_ns', ''), 'checkpoint_id': configurable['checkpoint_id']}
+        # A task writes a handful of channels, one upsert each
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            fields = {'channel': channel, 'value': self._dump(value), 'task_path': task_path, 'createdAt': _now()}
+            # Regular writes are kept as first saved, special ones (errors, interrupts) are replaced
+            update = {'$setOnInsert': fields} if write_idx >= 0 else {'$set': fields}
+            await self.writes.update_one({**key, 'task_id': task_id, 'idx': write_idx}, update, upsert=True)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await delete_checkpoints(self.checkpoints.database, thread_id)
+
+
+async def delete_checkpoints(db: AsyncDatabase, thread_id: str):
+    await db.get_collection(CHECKPOINTS_COLLECTION).delete_many({'thread_id': thread_id})
+    await db.get_collection(CHECKPOINT_WRITES_COLLECTION).delete_many({'thread_id': thread_id})
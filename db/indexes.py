@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import OperationFailure
+from cache.llm_cache import LLM_CACHE_COLLECTION
+from db.checkpoints import CHECKPOINTS_COLLECTION, CHECKPOINT_WRITES_COLLECTION, GRAPH_CHECKPOINT_TTL_SECONDS
+from db.leases import LEASES_COLLECTION
+from jobs.queue import JOBS_COLLECTION
+from services.idempotency import IDEMPOTENCY_COLLECTION
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', str(7 * 24 * 3600)))
+
+
+@dataclass
+class IndexSpec:
+    collection: str
+    keys: list[tuple[str, int]]
+    name: str
+    options: dict = field(default_factory=dict)
+
+
+INDEXES = [
+    # /lesson and /plan-lessons look lessons up by concept, in lesson order
+    IndexSpec('lessons', [('conceptId', 1), ('order', 1)], 'conceptId_order'),
+    # GET /roadmaps pages on (createdAt, _id), newest first
+    IndexSpec('roadmaps', [('createdAt', -1), ('_id', -1)], 'createdAt_id'),
+    # Workers claim the oldest queued job of the highest priority among the types they handle
+    IndexSpec(JOBS_COLLECTION, [('status', 1), ('type', 1), ('priority', -1), ('createdAt', 1)], 'status_type_priority_createdAt'),
+    # Prefetching looks up pending jobs per lesson and counts speculative jobs per roadmap
+    IndexSpec(JOBS_COLLECTION, [('payload.lessonId', 1), ('status', 1)], 'lessonId_status'),
+    IndexSpec(JOBS_COLLECTION, [('payload.roadmapId', 1), ('type', 1)], 'roadmapId_type'),
+    IndexSpec(JOBS_COLLECTION, [('finishedAt', 1)], 'finishedAt_ttl', {'expireAfterSeconds': JOB_RETENTION_SECONDS}),
+    IndexSpec(LLM_CACHE_COLLECTION, [('expiresAt', 1)], 'expiresAt_ttl', {'expireAfterSeconds': 0}),
+    IndexSpec(LEASES_COLLECTION, [('expiresAt', 1)], 'expiresAt_ttl', {'expireAfterSeconds': 0}),
+    IndexSpec(IDEMPOTENCY_COLLECTION, [('expiresAt', 1)], 'expiresAt_ttl', {'expireAfterSeconds': 0}),
+    # Resumed graph runs load the latest checkpoint of the job and its pending writes
+    IndexSpec(CHECKPOINTS_COLLECTION, [('thread_id', 1), ('checkpoint_ns', 1), ('checkpoint_id', -1)], 'thread_ns_checkpoint', {'unique': True}),
+    IndexSpec(CHECKPOINTS_COLLECTION, [('createdAt', 1)], 'createdAt_ttl', {'expireAfterSeconds': GRAPH_CHECKPOINT_TTL_SECONDS}),
+    IndexSpec(CHECKPOINT_WRITES_COLLECTION, [('thread_id', 1), ('checkpoint_ns', 1), ('checkpoint_id', 1), ('task_id', 1), ('idx', 1)], 'thread_ns_checkpoint_task_idx', {'unique': True}),
+    IndexSpec(CHECKPOINT_WRITES_COLLECTION, [('createdAt', 1)], 'createdAt_ttl', {'expireAfterSeconds': GRAPH_CHECKPOINT_TTL_SECONDS}),
+]
+
+
+async def ensure_indexes(db: AsyncDatabase, indexes: list[IndexSpec] = INDEXES):
+    """Creates any missing index, existing identical indexes are left alone"""
+    for spec in indexes:
+        try:
+            await db.get_collection(spec.collection).create_index(spec.keys, name=spec.name, **spec.options)
+        except OperationFailure as e:
+            # An index with the same name but different options exists, it has to be dropped by hand
+            logger.warning("Could not ensure index %s.%s: %s", spec.collection, spec.name, e)
+
+
+async def check_indexes(db: AsyncDatabase, indexes: list[IndexSpec] = INDEXES) -> dict:
+    """Reports declared indexes that are missing and existing indexes that have not been used since the last restart"""
+    report = {'missing': [], 'unused': []}
+
+    for collection_name in sorted({spec.collection for spec in indexes}):
+        collection = db.get_collection(collection_name)
+        existing = await collection.index_information()
+
+        for spec in indexes:
+            if spec.collection == collection_name and spec.name not in existing:
+                report['missing'].append(f"{collection_name}.{spec.name}")
+
+        stats_cursor = await collection.aggregate([{'$indexStats': {}}])
+        async for stats in stats_cursor:
+            if stats['name'] != '_id_' and stats['accesses']['ops'] == 0:
+                report['unused'].append(f"{collection_name}.{stats['name']}")
+
+    return report
+
+
+async def _main(check_only: bool):
+    from db.mongo import connect_to_mongo, close_mongo_connection, get_database
+
+    await connect_to_mongo()
+    try:
+        if not check_only:
+            await ensure_indexes(get_database())
+        print(json.dumps(await check_indexes(get_database()), indent=2))
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == '__main__':
+    asyncio.run(_main(check_only='--check' in sys.argv))
@@ -0,0 +1,43 @@
+import asyncio
+import datetime
+from datetime import timezone
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import DuplicateKeyError
+
+LEASES_COLLECTION = 'leases'
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(timezone.utc)
+
+
+async def acquire_lease(db: AsyncDatabase, lease_id: str, owner: str, seconds: float) -> bool:
+    """Takes the lease if it is free or expired, False while someone else holds it"""
+    now = _now()
+    try:
+        await db.get_collection(LEASES_COLLECTION).update_one(
+            {'_id': lease_id, '$or': [{'expiresAt': {'$lt': now}}, {'owner': owner}]},
+            {'$set': {'owner': owner, 'acquiredAt': now, 'expiresAt': now + datetime.timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def renew_lease(db: AsyncDatabase, lease_id: str, owner: str, seconds: float):
+    await db.get_collection(LEASES_COLLECTION).update_one(
+        {'_id': lease_id, 'owner': owner},
+        {'$set': {'expiresAt': _now() + datetime.timedelta(seconds=seconds)}}
+    )
+
+
+async def release_lease(db: AsyncDatabase, lease_id: str, owner: str):
+    await db.get_collection(LEASES_COLLECTION).delete_one({'_id': lease_id, 'owner': owner})
+
+
+async def wait_for_release(db: AsyncDatabase, lease_id: str, poll_interval: float):
+    """Returns once the lease has been released or has expired"""
+    leases_col = db.get_collection(LEASES_COLLECTION)
+    while await leases_col.count_documents({'_id': lease_id, 'expiresAt': {'$gt': _now()}}, limit=1):
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,92 @@
+"""Replaces the lesson copies embedded in roadmap concepts with references to the lessons collection,
+and sets `order` on lessons that predate it from their position in the concept's lessonIds.
+
+    python -m db.migrations.roadmap_lesson_refs [--dry-run]
+
+Safe to run more than once, roadmaps and lessons that were already migrated are skipped.
+"""
+import asyncio
+import sys
+from pymongo.asynchronous.database import AsyncDatabase
+
+
+async def migrate_roadmap(db: AsyncDatabase, roadmap: dict, dry_run: bool) -> int:
+    """Returns the number of concepts that were converted"""
+    lessons_col = db.get_collection('lessons')
+    converted = 0
+
+    for section in roadmap.get('sections', []):
+        for concept in section.get('concepts', []):
+            if 'lessons' not in concept:
+                continue
+
+            embedded = concept.pop('lessons') or []
+            lesson_ids = []
+            for order, lesson in enumerate(embedded):
+                lesson_id = lesson.get('_id')
+                exists = lesson_id is not None and await lessons_col.find_one({'_id': lesson_id}, {'_id': 1})
+                if not exists:
+                    # The embedded copy is the only one left, move it into the lessons collection
+                    lesson = {**lesson, 'conceptId': concept['_id'], 'order': lesson.get('order', order)}
+                    if not dry_run:
+                        lesson_id = (await lessons_col.insert_one(lesson)).inserted_id
+                lesson_ids.append(lesson_id)
+
+            concept['lessonIds'] = lesson_ids
+            converted += 1
+
+    if converted and not dry_run:
+        await db.get_collection('roadmaps').update_one(
+            {'_id': roadmap['_id']},
+            {'$set': {'sections': roadmap['sections']}}
+        )
+    return converted
+
+
+async def backfill_lesson_order(db: AsyncDatabase, roadmap: dict, dry_run: bool) -> int:
+    """Lessons are read sorted by order, returns the number of lessons that had none"""
+    lessons_col = db.get_collection('lessons')
+    backfilled = 0
+
+    for section in roadmap.get('sections', []):
+        for concept in section.get('concepts', []):
+            for order, lesson_id in enumerate(concept.get('lessonIds', [])):
+                query = {'_id': lesson_id, 'order': {'$exists': False}}
+                if dry_run:
+                    backfilled += await lessons_col.count_documents(query, limit=1)
+                else:
+                    backfilled += (await lessons_col.update_one(query, {'$set': {'order': order}})).modified_count
+    return backfilled
+
+
+async def migrate(db: AsyncDatabase, dry_run: bool = False):
+    roadmaps = db.get_collection('roadmaps').find({}, {'sections': 1})
+    migrated_roadmaps = 0
+    migrated_concepts = 0
+    backfilled_lessons = 0
+
+    async for roadmap in roadmaps:
+        converted = await migrate_roadmap(db, roadmap, dry_run)
+        if converted:
+            migrated_roadmaps += 1
+            migrated_concepts += converted
+        # Also covers roadmaps converted by an earlier run of this migration
+        backfilled_lessons += await backfill_lesson_order(db, roadmap, dry_run)
+
+    prefix = '[dry run] ' if dry_run else ''
+    print(f"{prefix}Migrated {migrated_concepts} concepts in {migrated_roadmaps} roadmaps")
+    print(f"{prefix}Set the order of {backfilled_lessons} lessons")
+
+
+async def _main(dry_run: bool):
+    from db.mongo import connect_to_mongo, close_mongo_connection, get_database
+
+    await connect_to_mongo()
+    try:
+        await migrate(get_database(), dry_run)
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == '__main__':
+    asyncio.run(_main(dry_run='--dry-run' in sys.argv))
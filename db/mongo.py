@@ -1,9 +1,57 @@
 from dotenv import load_dotenv
+import logging
 import os
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
+from utils.metrics import MongoCommandMetrics
+from utils.tracing import MongoCommandTracer
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "prod")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+
+client: AsyncMongoClient | None = None
+
+
+def create_client() -> AsyncMongoClient:
+    return AsyncMongoClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[MongoCommandMetrics(), MongoCommandTracer()],
+    )
+
+
+async def connect_to_mongo():
+    """Creates the shared client and pings the cluster so the pool is warm before the first request"""
+    global client
+    client = create_client()
+    await client.admin.command('ping')
+    logger.info("Connected to MongoDB (pool size %s-%s)", MONGO_MIN_POOL_SIZE, MONGO_MAX_POOL_SIZE)
+
+
+async def close_mongo_connection():
+    global client
+    if client is not None:
+        await client.close()
+        client = None
+
 
-client = MongoClient(MONGO_URI)
\ No newline at end of file
+def get_database() -> AsyncDatabase:
+    """FastAPI dependency returning the application database"""
+    if client is None:
+        raise RuntimeError("MongoDB client is not initialized, was the app lifespan started?")
+    return client.get_database(MONGO_DB_NAME)
@@ -0,0 +1,7 @@
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+
+def serialize_document(doc):
+    """Makes a Mongo document JSON safe, ObjectIds become strings and datetimes ISO strings"""
+    return jsonable_encoder(doc, custom_encoder={ObjectId: str})
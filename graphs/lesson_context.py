@@ -0,0 +1,88 @@
+import logging
+import os
+from dotenv import load_dotenv
+from models.Roadmap import Roadmap
+from models.Section import Section
+from utils.tokens import count_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LESSON_CONTEXT_TOKEN_BUDGET = int(os.getenv('LESSON_CONTEXT_TOKEN_BUDGET', '1200'))
+LESSON_CONTEXT_NEIGHBOURS = int(os.getenv('LESSON_CONTEXT_NEIGHBOURS', '1'))
+
+# From most to least detailed, the first level that fits the budget is used
+_DETAIL_LEVELS = [
+    {'current': 'full', 'neighbours': 'full'},
+    {'current': 'full', 'neighbours': 'concept_titles'},
+    {'current': 'full', 'neighbours': 'title'},
+    {'current': 'concept_titles', 'neighbours': 'title'},
+]
+
+
+def _render_section(number: int, section: Section, detail: str, marker: str = '') -> list[str]:
+    lines = [f"{number}. {section.title}{marker}"]
+    if detail == 'title':
+        return lines
+    if detail == 'full':
+        lines.append(f"   {section.description}")
+    for concept in section.concepts:
+        lines.append(f"   - {concept.title}: {concept.description}" if detail == 'full' else f"   - {concept.title}")
+    return lines
+
+
+def _render_outline(roadmap: Roadmap, current_index: int, level: dict, neighbours: int, max_distance: int = None) -> str:
+    lines = [f"Topic: {roadmap.topic}", "Sections:"]
+    # Without a current section the outline is trimmed from the end
+    anchor = max(current_index, 0)
+    skipped = False
+    for i, section in enumerate(roadmap.sections):
+        if max_distance is not None and abs(i - anchor) > max_distance:
+            if not skipped:
+                lines.append("...")
+            skipped = True
+            continue
+        skipped = False
+
+        if i == current_index:
+            lines += _render_section(i + 1, section, level['current'], '  <- current section')
+        elif current_index >= 0 and abs(i - current_index) <= neighbours:
+            lines += _render_section(i + 1, section, level['neighbours'])
+        else:
+            lines += _render_section(i + 1, section, 'title')
+    return "\n".join(lines)
+
+
+def build_roadmap_context(
+        roadmap: Roadmap,
+        current_section_title: str,
+        token_budget: int = LESSON_CONTEXT_TOKEN_BUDGET,
+        neighbours: int = LESSON_CONTEXT_NEIGHBOURS
+) -> tuple[str, int]:
+    """Compact roadmap outline for the lesson prompt: full detail around the current section, titles elsewhere.
+
+    Returns the outline and its token count.
+    """
+    current_index = next((i for i, section in enumerate(roadmap.sections) if section.title == current_section_title), -1)
+    if current_index < 0:
+        logger.warning("Section %r is not in the roadmap, the outline has no current section", current_section_title)
+
+    outline = ''
+    tokens = 0
+    for level in _DETAIL_LEVELS:
+        outline = _render_outline(roadmap, current_index, level, neighbours)
+        tokens = count_tokens(outline)
+        if tokens <= token_budget:
+            return outline, tokens
+
+    # Even the leanest outline is too long, drop the sections furthest from the current one
+    leanest = _DETAIL_LEVELS[-1]
+    for max_distance in range(len(roadmap.sections) - 1, -1, -1):
+        outline = _render_outline(roadmap, current_index, leanest, neighbours, max_distance)
+        tokens = count_tokens(outline)
+        if tokens <= token_budget:
+            break
+    else:
+        logger.warning("Roadmap outline is %s tokens, over the budget of %s", tokens, token_budget)
+    return outline, tokens
@@ -1,14 +1,27 @@
+import logging
+import os
 from typing import Optional, List
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from dotenv import load_dotenv
 from langgraph.graph import StateGraph
 from pydantic import BaseModel, Field
 from langgraph.constants import START, END
 from agents.lesson_generator_agent import lesson_generator_agent, lesson_generator_system_prompt
 from agents.lesson_reviewer_agent import  review_lesson, LessonReview
+from graphs.lesson_context import LESSON_CONTEXT_TOKEN_BUDGET, build_roadmap_context
+from graphs.lesson_validation import LESSON_REVIEW_SKIP_CONFIDENCE, LessonValidation, validate_lesson
 from models.Lesson import Lesson
+from graphs.runner import NODE_RETRY_POLICY, instrument_node
+from utils.metrics import LESSON_CONTEXT_TOKENS, LESSON_VALIDATIONS
 from models.Roadmap import Roadmap
 
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
 MAX_ITERATIONS = 1
+# Extra generations allowed for lessons that fail the local validator, on top of MAX_ITERATIONS
+LESSON_VALIDATION_RETRIES = int(os.getenv('LESSON_VALIDATION_RETRIES', '1'))
 
 class LessonAgentState(BaseModel):
     roadmap: Roadmap = Field(..., description="The overall roadmap to see the scope of the roadmap")
@@ -20,44 +33,51 @@ class LessonAgentState(BaseModel):
     learning_objectives: List[str] = Field(..., description="Learning objectives")
     lessons_in_concept: List[str] = Field(..., description="All lessons in current concept for scope orientation")
     review: Optional[LessonReview] = None
+    validation: Optional[LessonValidation] = None
     iteration: int = 0
     last_node: Optional[str] = None
+    roadmap_context: Optional[str] = None
 
 
 def lesson_supervisor_node(state: LessonAgentState) -> str:
     is_approved = state.review and state.review.approved
-    print(f"Supervisor - Iteration: {state.iteration}, Approved: {is_approved}, Last node: {state.last_node}")
+    logger.debug("Supervisor - Iteration: %s, Approved: %s, Last node: %s", state.iteration, is_approved, state.last_node)
 
     if state.iteration >= MAX_ITERATIONS or is_approved:
-        print("Routing to END")
+        logger.debug("Routing to END")
         return END
 
     # If we just generated a lesson and no review exists, go to reviewer
     if state.last_node == 'lesson_generator_node' and not state.review:
-        print('Routing to lesson reviewer (first review)')
+        logger.debug('Routing to lesson reviewer (first review)')
         return 'lesson_reviewer_node'
 
     # If we have a review but it's not approved, go back to generator
     if state.review and not state.review.approved:
-        print("Routing to lesson generator (needs improvement)")
+        logger.debug("Routing to lesson generator (needs improvement)")
         return 'lesson_generator_node'
 
     # If we just reviewed and it's approved, we're done
     if state.last_node == 'lesson_reviewer_node' and state.review and state.review.approved:
-        print("Routing to END (approved)")
+        logger.debug("Routing to END (approved)")
         return END
 
     # Default to generator for first run
-    print("Routing to lesson generator (first run)")
+    logger.debug("Routing to lesson generator (first run)")
     return 'lesson_generator_node'
 
 
-def lesson_generator_node(state: LessonAgentState) -> LessonAgentState:
-    print("Generating lesson...")
+async def lesson_generator_node(state: LessonAgentState) -> LessonAgentState:
+    logger.info("Generating lesson", extra={'lesson_title': state.lesson_title})
+    if state.roadmap_context is None:
+        state.roadmap_context, context_tokens = build_roadmap_context(state.roadmap, state.current_section_title)
+        logger.debug("Roadmap context: %s tokens (budget %s)", context_tokens, LESSON_CONTEXT_TOKEN_BUDGET)
+        LESSON_CONTEXT_TOKENS.observe(context_tokens)
+
     generator_messages: list[SystemMessage | HumanMessage | AIMessage] = [
         SystemMessage(content=lesson_generator_system_prompt),
         HumanMessage(content=f"""
-                Roadmap: {state.roadmap.model_dump_json(indent=2)}\n\n
+                Roadmap outline:\n{state.roadmap_context}\n\n
                 Current Section: {state.current_section_title}\n\n
                 Current Concept: {state.current_concept_title}\n\n
                 Lesson Title: {state.lesson_title}\n\n
@@ -66,26 +86,63 @@ def lesson_generator_node(state: LessonAgentState) -> LessonAgentState:
             """)
     ]
 
-    feedback = getattr(state.review, 'feedback', None)
-    approved = getattr(state.review, 'approved', False)
+    if state.validation and not state.validation.passed:
+        feedback = state.validation.feedback()
+    elif state.review and not state.review.approved:
+        feedback = state.review.feedback
+    else:
+        feedback = None
 
-    if feedback and not approved:
+    if feedback:
         generator_messages.extend([
             AIMessage(content=state.lesson.content),
             HumanMessage(content=f"Please improve the lesson based on this feedback:\n{feedback}")
         ])
 
-    result = lesson_generator_agent.invoke(generator_messages)
+    result = await lesson_generator_agent.ainvoke(generator_messages)
     state.iteration += 1
     state.last_node = 'lesson_generator_node'
     state.lesson = result
 
     return state
 
-def lesson_reviewer_node(state: LessonAgentState) -> LessonAgentState:
-    print('Reviewing lesson...')
+async def lesson_validator_node(state: LessonAgentState) -> LessonAgentState:
+    state.validation = validate_lesson(state.lesson, state.lesson_title, state.lessons_in_concept)
+    if state.validation.errors or state.validation.warnings:
+        logger.info(
+            "Lesson validation found problems",
+            extra={'lesson_title': state.lesson_title, 'errors': state.validation.errors, 'warnings': state.validation.warnings}
+        )
+    state.last_node = 'lesson_validator_node'
+    return state
+
 
-    result = review_lesson(
+def lesson_validation_router(state: LessonAgentState) -> str:
+    """Sends broken lessons straight back to the generator and lets clean ones skip the LLM review"""
+    validation = state.validation
+    if not validation.passed:
+        if state.iteration < MAX_ITERATIONS + LESSON_VALIDATION_RETRIES:
+            outcome, route = 'regenerate', 'lesson_generator_node'
+        else:
+            logger.warning("Keeping a lesson that failed validation", extra={'lesson_title': state.lesson_title})
+            outcome, route = 'accept_invalid', END
+    elif validation.confidence >= LESSON_REVIEW_SKIP_CONFIDENCE:
+        outcome, route = 'skip_review', END
+    elif state.iteration < MAX_ITERATIONS:
+        outcome, route = 'review', 'lesson_reviewer_node'
+    else:
+        # A rejection could not be acted on anymore
+        outcome, route = 'accept', END
+
+    LESSON_VALIDATIONS.labels(outcome).inc()
+    logger.debug("Validation confidence %.2f, routing to %s", validation.confidence, route)
+    return route
+
+
+async def lesson_reviewer_node(state: LessonAgentState) -> LessonAgentState:
+    logger.info('Reviewing lesson', extra={'lesson_title': state.lesson_title})
+
+    result = await review_lesson(
         lesson_content=state.lesson.model_dump()['content'],
         lessons_in_concept=state.lessons_in_concept,
         current_lesson_title=state.lesson_title
@@ -98,12 +155,14 @@ def lesson_reviewer_node(state: LessonAgentState) -> LessonAgentState:
 
 graph_builder = StateGraph(LessonAgentState)
 
-graph_builder.add_node('lesson_generator_node', lesson_generator_node)
-graph_builder.add_node('lesson_reviewer_node', lesson_reviewer_node)
+graph_builder.add_node('lesson_generator_node', instrument_node('lesson_generation', 'lesson_generator_node', lesson_generator_node), retry_policy=NODE_RETRY_POLICY)
+graph_builder.add_node('lesson_validator_node', instrument_node('lesson_generation', 'lesson_validator_node', lesson_validator_node))
+graph_builder.add_node('lesson_reviewer_node', instrument_node('lesson_generation', 'lesson_reviewer_node', lesson_reviewer_node), retry_policy=NODE_RETRY_POLICY)
 
 graph_builder.add_edge(START, 'lesson_generator_node')
 
-graph_builder.add_conditional_edges('lesson_generator_node', lesson_supervisor_node)
+graph_builder.add_edge('lesson_generator_node', 'lesson_validator_node')
+graph_builder.add_conditional_edges('lesson_validator_node', lesson_validation_router)
 graph_builder.add_conditional_edges('lesson_reviewer_node', lesson_supervisor_node)
 
 lesson_generation_graph = graph_builder.compile()
@@ -0,0 +1,127 @@
+import os
+import re
+from typing import List
+from dotenv import load_dotenv
+from pydantic import BaseModel
+from models.Lesson import Lesson
+from models.MCQ import MCQ
+
+load_dotenv()
+
+LESSON_MIN_EXERCISES = 3
+LESSON_MAX_EXERCISES = 5
+LESSON_MIN_CONTENT_CHARS = int(os.getenv('LESSON_MIN_CONTENT_CHARS', '1200'))
+LESSON_MAX_CONTENT_CHARS = int(os.getenv('LESSON_MAX_CONTENT_CHARS', '20000'))
+# Share of a sibling lesson's title words that a heading may repeat before it counts as overlap
+LESSON_TITLE_OVERLAP_THRESHOLD = float(os.getenv('LESSON_TITLE_OVERLAP_THRESHOLD', '0.75'))
+# Lessons without errors at or above this confidence skip the LLM review
+LESSON_REVIEW_SKIP_CONFIDENCE = float(os.getenv('LESSON_REVIEW_SKIP_CONFIDENCE', '0.8'))
+
+WARNING_PENALTY = 0.25
+
+_FENCE = re.compile(r'^\s*(```|~~~)')
+_HEADING = re.compile(r'^\s*#{1,6}\s+(.+?)\s*#*\s*$')
+_WORD = re.compile(r'[a-z0-9+#]+')
+_STOP_WORDS = {'a', 'an', 'and', 'the', 'of', 'to', 'in', 'on', 'for', 'with', 'by', 'vs', 'or', 'your', 'how', 'what', 'why', 'is', 'are', 'into'}
+
+
+class LessonValidation(BaseModel):
+    errors: List[str] = []
+    warnings: List[str] = []
+    confidence: float = 1.0
+
+    @property
+    def passed(self) -> bool:
+        return not self.errors
+
+    def feedback(self) -> str:
+        return "\n".join(f"- {problem}" for problem in [*self.errors, *self.warnings])
+
+
+def _title_words(title: str) -> set[str]:
+    return {word for word in _WORD.findall(title.lower()) if word not in _STOP_WORDS}
+
+
+def _check_markdown(content: str) -> tuple[List[str], List[str]]:
+    """Code fences must be closed, headings are collected outside of code blocks"""
+    errors = []
+    headings = []
+    open_fence = None
+    for line in content.splitlines():
+        fence = _FENCE.match(line)
+        if fence:
+            if open_fence is None:
+                open_fence = fence.group(1)
+            elif fence.group(1) == open_fence:
+                open_fence = None
+            continue
+        if open_fence is None:
+            heading = _HEADING.match(line)
+            if heading:
+                headings.append(heading.group(1))
+    if open_fence is not None:
+        errors.append(f"A code block opened with {open_fence} is never closed.")
+    return errors, headings
+
+
+def _check_exercises(lesson: Lesson) -> List[str]:
+    errors = []
+    count = len(lesson.exercises)
+    if not LESSON_MIN_EXERCISES <= count <= LESSON_MAX_EXERCISES:
+        errors.append(f"The lesson has {count} exercises, it needs {LESSON_MIN_EXERCISES} to {LESSON_MAX_EXERCISES}.")
+
+    for number, exercise in enumerate(lesson.exercises, start=1):
+        is_mcq = isinstance(exercise.exercise, MCQ)
+        if (exercise.type == 'mcq') != is_mcq:
+            errors.append(f"Exercise {number} has type '{exercise.type}' but is shaped like {'an MCQ' if is_mcq else 'an open question'}.")
+        if not exercise.exercise.question.strip():
+            errors.append(f"Exercise {number} has no question text.")
+        if not is_mcq:
+            continue
+        options = exercise.exercise.answer_options
+        if len(options) < 2:
+            errors.append(f"Exercise {number} needs at least 2 answer options.")
+        elif len({option.strip().lower() for option in options}) != len(options):
+            errors.append(f"Exercise {number} has duplicate answer options.")
+        if not 0 <= exercise.exercise.answer_index < len(options):
+            errors.append(f"Exercise {number} has answer_index {exercise.exercise.answer_index}, which is not one of its {len(options)} answer options.")
+    return errors
+
+
+def _check_overlap(headings: List[str], lesson_title: str, lessons_in_concept: List[str]) -> List[str]:
+    """Headings that repeat most of another lesson's title suggest the lesson covers that lesson's topic"""
+    warnings = []
+    current = _title_words(lesson_title)
+    for other in lessons_in_concept:
+        other_words = _title_words(other)
+        if not other_words or other_words <= current:
+            continue
+        for heading in headings:
+            shared = _title_words(heading) & other_words
+            if len(shared) / len(other_words) >= LESSON_TITLE_OVERLAP_THRESHOLD:
+                warnings.append(f"The section '{heading}' seems to cover the separate lesson '{other}', leave it to that lesson.")
+                break
+    return warnings
+
+
+def validate_lesson(lesson: Lesson, lesson_title: str, lessons_in_concept: List[str]) -> LessonValidation:
+    """Structural checks that need no model call. Errors mean the lesson must be regenerated,
+    warnings lower the confidence that it would pass the LLM review"""
+    errors = _check_exercises(lesson)
+    markdown_errors, headings = _check_markdown(lesson.content)
+    errors.extend(markdown_errors)
+
+    warnings = []
+    length = len(lesson.content.strip())
+    if length < LESSON_MIN_CONTENT_CHARS:
+        errors.append(f"The lesson content is only {length} characters, explain the topic in more depth with examples.")
+    elif length > LESSON_MAX_CONTENT_CHARS:
+        warnings.append(f"The lesson content is {length} characters, keep it focused on the lesson title.")
+    if not headings:
+        warnings.append("The lesson content has no Markdown headings to structure it.")
+    if not lesson.summary.strip():
+        warnings.append("The lesson summary is empty.")
+    warnings.extend(_check_overlap(headings, lesson_title, [title for title in lessons_in_concept if title != lesson_title]))
+
+    confidence = 0.0 if errors else max(0.0, 1.0 - WARNING_PENALTY * len(warnings))
+    return LessonValidation(errors=errors, warnings=warnings, confidence=confidence)
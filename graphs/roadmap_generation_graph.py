@@ -1,3 +1,4 @@
+import logging
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langgraph.constants import START, END
 from langgraph.graph import StateGraph
@@ -6,6 +7,7 @@ from typing import List
 from agents.roadmap_generator_agent import roadmap_generator_agent, generator_system_prompt
 from agents.roadmap_reviewer_agent import roadmap_reviewer_agent, review_system_prompt
 from models.Roadmap import Roadmap
+from graphs.runner import NODE_RETRY_POLICY, instrument_node
 
 class RoadmapStatus(BaseModel):
     roadmap: Roadmap = None
@@ -19,12 +21,14 @@ class RoadmapGenerationAgentState(BaseModel):
     iteration: int = 0
     next_node: str = None
 
+logger = logging.getLogger(__name__)
+
 MAX_ITERATIONS = 1
 
 def roadmap_supervisor_node(state: RoadmapGenerationAgentState) -> RoadmapGenerationAgentState:
     """Decides which node to run next based on roadmap state"""
     if state.iteration >= MAX_ITERATIONS:
-        print("⚠️ Max iterations reached. Ending loop.")
+        logger.debug("Max iterations reached, ending loop")
         state.next_node = "__end__"
 
     elif not state.roadmap_status.roadmap:
@@ -38,16 +42,15 @@ def roadmap_supervisor_node(state: RoadmapGenerationAgentState) -> RoadmapGenera
             state.next_node = "roadmap_generator"
 
     else:
-        print("✅ Roadmap approved!")
+        logger.debug("Roadmap approved")
         state.next_node = "__end__"
 
     return state
 
 
-def roadmap_generation_node(state: RoadmapGenerationAgentState) -> RoadmapGenerationAgentState:
+async def roadmap_generation_node(state: RoadmapGenerationAgentState) -> RoadmapGenerationAgentState:
     """Uses roadmap_generator_agent to generate or refine a roadmap."""
-    print("🧩 Generating roadmap...")
-    state.iteration += 1
+    logger.info("Generating roadmap", extra={'topic': state.topic, 'iteration': state.iteration + 1})
 
     messages_for_gen = [
         SystemMessage(content=generator_system_prompt),
@@ -59,7 +62,9 @@ def roadmap_generation_node(state: RoadmapGenerationAgentState) -> RoadmapGenera
             HumanMessage(content=f"Please improve the roadmap based on this feedback:\n{state.roadmap_status.feedback}")
         )
 
-    roadmap_result = roadmap_generator_agent.invoke(messages_for_gen)
+    roadmap_result = await roadmap_generator_agent.ainvoke(messages_for_gen)
+    # Counted once the call succeeded, a retried node sees the same state again
+    state.iteration += 1
     state.roadmap_status.roadmap = roadmap_result
 
     state.messages.append(AIMessage(content=roadmap_result.model_dump_json(indent=2)))
@@ -67,10 +72,10 @@ def roadmap_generation_node(state: RoadmapGenerationAgentState) -> RoadmapGenera
     return state
 
 
-def roadmap_review_node(state: RoadmapGenerationAgentState) -> RoadmapGenerationAgentState:
-    print('Reviewing roadmap...')
+async def roadmap_review_node(state: RoadmapGenerationAgentState) -> RoadmapGenerationAgentState:
+    logger.info('Reviewing roadmap', extra={'topic': state.topic})
 
-    review_result = roadmap_reviewer_agent.invoke(
+    review_result = await roadmap_reviewer_agent.ainvoke(
         [SystemMessage(review_system_prompt), *state.messages]
     )
 
@@ -85,9 +90,9 @@ def roadmap_review_node(state: RoadmapGenerationAgentState) -> RoadmapGeneration
 
 graph_builder = StateGraph(RoadmapGenerationAgentState)
 
-graph_builder.add_node('roadmap_generator', roadmap_generation_node)
+graph_builder.add_node('roadmap_generator', instrument_node('roadmap_generation', 'roadmap_generator', roadmap_generation_node), retry_policy=NODE_RETRY_POLICY)
 graph_builder.add_node('roadmap_supervisor', roadmap_supervisor_node)
-graph_builder.add_node('roadmap_reviewer', roadmap_review_node)
+graph_builder.add_node('roadmap_reviewer', instrument_node('roadmap_generation', 'roadmap_reviewer', roadmap_review_node), retry_policy=NODE_RETRY_POLICY)
 
 graph_builder.add_edge(START, 'roadmap_supervisor')
 graph_builder.add_edge('roadmap_generator', 'roadmap_supervisor')
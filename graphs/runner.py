@@ -0,0 +1,80 @@
+import logging
+import os
+from typing import Any, Awaitable, Callable, Optional
+from dotenv import load_dotenv
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.types import RetryPolicy, default_retry_on
+from pymongo.asynchronous.database import AsyncDatabase
+from agents.scheduler import LLMQueueTimeoutError
+from agents.structured_agent import StructuredOutputError
+from db.checkpoints import MongoCheckpointSaver
+from jobs.queue import job_id_var
+from utils.metrics import timed_node
+from utils.tracing import traced_node
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GRAPH_CHECKPOINTS_ENABLED = os.getenv('GRAPH_CHECKPOINTS_ENABLED', 'true').lower() == 'true'
+GRAPH_NODE_MAX_ATTEMPTS = int(os.getenv('GRAPH_NODE_MAX_ATTEMPTS', '3'))
+GRAPH_NODE_RETRY_INITIAL_SECONDS = float(os.getenv('GRAPH_NODE_RETRY_INITIAL_SECONDS', '1'))
+
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+
+def is_retryable(error: Exception) -> bool:
+    """Invalid output that survived the repair step and transient provider errors are worth another attempt"""
+    if isinstance(error, StructuredOutputError):
+        return True
+    if isinstance(error, LLMQueueTimeoutError):
+        # Already waited out its deadline
+        return False
+    status_code = getattr(error, 'status_code', None)
+    if isinstance(status_code, int):
+        return status_code in (408, 409, 429) or status_code >= 500
+    return default_retry_on(error)
+
+
+# Retries only the node that failed, the state left by earlier nodes is kept
+NODE_RETRY_POLICY = RetryPolicy(
+    max_attempts=GRAPH_NODE_MAX_ATTEMPTS,
+    initial_interval=GRAPH_NODE_RETRY_INITIAL_SECONDS,
+    backoff_factor=2.0,
+    max_interval=30.0,
+    jitter=True,
+    retry_on=is_retryable,
+)
+
+
+def instrument_node(graph: str, node: str, func):
+    """Records latency and opens a trace span for a node, use with the name the node is added under"""
+    return timed_node(graph, node, traced_node(graph, node, func))
+
+
+async def run_graph(graph: CompiledStateGraph, initial_state: Any, on_progress: Optional[ProgressCallback] = None, db: Optional[AsyncDatabase] = None) -> dict:
+    """Runs a graph to completion, reporting the name of every node as it finishes.
+    Inside a job, the run is checkpointed to Mongo under the job id and a retried job continues after the last node
+    that completed, or gets the final state right away when the graph had already finished"""
+    config = None
+    graph_input = initial_state
+    thread_id = job_id_var.get()
+    if GRAPH_CHECKPOINTS_ENABLED and db is not None and thread_id:
+        graph = graph.copy(update={'checkpointer': MongoCheckpointSaver(db)})
+        config = {'configurable': {'thread_id': thread_id}}
+        snapshot = await graph.aget_state(config)
+        if snapshot.values and not snapshot.next:
+            logger.info("Graph of job %s already finished, using its checkpoint", thread_id)
+            return snapshot.values
+        if snapshot.next:
+            logger.info("Resuming graph of job %s at %s", thread_id, ', '.join(snapshot.next))
+            graph_input = None
+
+    final_state = None
+    async for mode, chunk in graph.astream(graph_input, config, stream_mode=['updates', 'values']):
+        if mode == 'values':
+            final_state = chunk
+        elif on_progress:
+            for node_name in chunk:
+                await on_progress(node_name)
+    return final_state
@@ -0,0 +1,54 @@
+from pymongo.asynchronous.database import AsyncDatabase
+from agents.scheduler import LLM_PRIORITY_BACKGROUND
+from graphs.runner import ProgressCallback
+from services.lesson_service import LessonGenerationParams, LessonNotFoundError, claim_prefetched_lesson, generate_and_save_lesson, is_lesson_generated
+from services.prefetch_service import PREFETCH_JOB_TYPE, schedule_prefetch
+from services.roadmap_service import generate_and_save_roadmap
+
+
+class NonRetryableJobError(Exception):
+    """Raised by a handler when running the job again cannot succeed"""
+
+
+async def run_roadmap_job(db: AsyncDatabase, payload: dict, on_progress: ProgressCallback) -> dict:
+    return await generate_and_save_roadmap(db, payload['topic'], on_progress)
+
+
+async def run_lesson_job(db: AsyncDatabase, payload: dict, on_progress: ProgressCallback) -> dict:
+    params = LessonGenerationParams(**payload)
+    try:
+        result = await generate_and_save_lesson(db, params, on_progress)
+    except LessonNotFoundError as e:
+        raise NonRetryableJobError(str(e)) from e
+    await schedule_prefetch(db, params)
+    return result
+
+
+async def run_lesson_prefetch_job(db: AsyncDatabase, payload: dict, on_progress: ProgressCallback) -> dict:
+    """Generates a lesson ahead of time without unlocking it, prefetches never schedule further prefetches"""
+    params = LessonGenerationParams(**payload)
+    if await is_lesson_generated(db, params.lessonId):
+        return {"lesson_id": params.lessonId, "skipped": True}
+    try:
+        result = await generate_and_save_lesson(db, params, on_progress, speculative=True)
+    except LessonNotFoundError as e:
+        raise NonRetryableJobError(str(e)) from e
+    # Opened while generating (see promote_prefetch_job), so it is no longer speculative
+    await claim_prefetched_lesson(db, params.lessonId, only_opened=True)
+    return result
+
+
+JOB_HANDLERS = {
+    'roadmap': run_roadmap_job,
+    'lesson': run_lesson_job,
+    PREFETCH_JOB_TYPE: run_lesson_prefetch_job,
+}
+
+# Job types that only get a few of a worker's slots, so they never hold up work a user is waiting for
+LOW_PRIORITY_JOB_TYPES = {PREFETCH_JOB_TYPE}
+
+# Model calls of these jobs wait behind the ones a user is waiting on
+JOB_LLM_PRIORITIES = {
+    'roadmap': LLM_PRIORITY_BACKGROUND,
+    PREFETCH_JOB_TYPE: LLM_PRIORITY_BACKGROUND,
+}
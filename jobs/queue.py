@@ -0,0 +1,166 @@
+import datetime
+import os
+from contextvars import ContextVar
+from datetime import timezone
+from typing import Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from pymongo.asynchronous.database import AsyncDatabase
+from utils.log import request_id_var
+from utils.tracing import trace_headers
+
+load_dotenv()
+
+JOBS_COLLECTION = 'jobs'
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+# Workers take higher priorities first, jobs of the same priority in the order they were queued
+JOB_PRIORITY_NORMAL = 10
+JOB_PRIORITY_LOW = 0
+
+# Id of the job the current task is running, None outside of jobs
+job_id_var: ContextVar[Optional[str]] = ContextVar('job_id', default=None)
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(timezone.utc)
+
+
+async def enqueue_job(db: AsyncDatabase, job_type: str, payload: dict, priority: int = JOB_PRIORITY_NORMAL) -> str:
+    now = _now()
+    result = await db.get_collection(JOBS_COLLECTION).insert_one({
+        'type': job_type,
+        'payload': payload,
+        'priority': priority,
+        'status': 'queued',
+        'progress': None,
+        'result': None,
+        'error': None,
+        'attempts': 0,
+        'createdAt': now,
+        'updatedAt': now,
+        'leaseExpiresAt': None,
+        'workerId': None,
+        'requestId': request_id_var.get(),
+        'trace': trace_headers(),
+    })
+    return str(result.inserted_id)
+
+
+async def get_job(db: AsyncDatabase, job_id: str) -> Optional[dict]:
+    try:
+        object_id = ObjectId(job_id)
+    except InvalidId:
+        return None
+    return await db.get_collection(JOBS_COLLECTION).find_one({'_id': object_id})
+
+
+async def find_active_job(db: AsyncDatabase, job_type: str, payload_match: dict) -> Optional[str]:
+    """Id of a queued or running job of the type whose payload has the given values"""
+    job = await db.get_collection(JOBS_COLLECTION).find_one(
+        {'type': job_type, 'status': {'$in': ['queued', 'running']}, **{f'payload.{key}': value for key, value in payload_match.items()}},
+        {'_id': 1}
+    )
+    return str(job['_id']) if job else None
+
+
+def serialize_job(job: dict) -> dict:
+    return {
+        'jobId': str(job['_id']),
+        'type': job['type'],
+        'status': job['status'],
+        'progress': job.get('progress'),
+        'result': job.get('result'),
+        'error': job.get('error'),
+        'attempts': job.get('attempts', 0),
+        'createdAt': job['createdAt'].isoformat(),
+        'updatedAt': job['updatedAt'].isoformat(),
+    }
+
+
+async def claim_next_job(db: AsyncDatabase, worker_id: str, job_types: list[str]) -> Optional[dict]:
+    """Atomically takes the oldest queued job of the highest priority, or a running job whose worker stopped renewing its lease"""
+    now = _now()
+    return await db.get_collection(JOBS_COLLECTION).find_one_and_update(
+        {
+            'type': {'$in': job_types},
+            '$or': [
+                {'status': 'queued'},
+                {'status': 'running', 'leaseExpiresAt': {'$lt': now}},
+            ]
+        },
+        {
+            '$set': {
+                'status': 'running',
+                'workerId': worker_id,
+                'leaseExpiresAt': now + datetime.timedelta(seconds=JOB_LEASE_SECONDS),
+                'updatedAt': now,
+            },
+            '$inc': {'attempts': 1},
+        },
+        sort=[('priority', -1), ('createdAt', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def renew_lease(db: AsyncDatabase, job_id: ObjectId, worker_id: str):
+    now = _now()
+    await db.get_collection(JOBS_COLLECTION).update_one(
+        {'_id': job_id, 'workerId': worker_id, 'status': 'running'},
+        {'$set': {'leaseExpiresAt': now + datetime.timedelta(seconds=JOB_LEASE_SECONDS), 'updatedAt': now}}
+    )
+
+
+async def update_progress(db: AsyncDatabase, job_id: ObjectId, worker_id: str, progress: str):
+    await db.get_collection(JOBS_COLLECTION).update_one(
+        {'_id': job_id, 'workerId': worker_id},
+        {'$set': {'progress': progress, 'updatedAt': _now()}}
+    )
+
+
+async def complete_job(db: AsyncDatabase, job_id: ObjectId, worker_id: str, result: dict):
+    now = _now()
+    await db.get_collection(JOBS_COLLECTION).update_one(
+        {'_id': job_id, 'workerId': worker_id},
+        {'$set': {
+            'status': 'succeeded',
+            'result': result,
+            'progress': 'done',
+            'leaseExpiresAt': None,
+            'updatedAt': now,
+            'finishedAt': now,
+        }}
+    )
+
+
+async def fail_job(db: AsyncDatabase, job: dict, worker_id: str, error: str, retryable: bool = True):
+    """Puts the job back in the queue until it runs out of attempts"""
+    now = _now()
+    should_retry = retryable and job.get('attempts', 0) < JOB_MAX_ATTEMPTS
+    update = {
+        'status': 'queued' if should_retry else 'failed',
+        'error': error,
+        'leaseExpiresAt': None,
+        'workerId': None,
+        'updatedAt': now,
+    }
+    if not should_retry:
+        update['finishedAt'] = now
+    await db.get_collection(JOBS_COLLECTION).update_one(
+        {'_id': job['_id'], 'workerId': worker_id},
+        {'$set': update}
+    )
+
+
+async def release_job(db: AsyncDatabase, job_id: ObjectId, worker_id: str):
+    """Hands an interrupted job back to the queue without counting the attempt"""
+    await db.get_collection(JOBS_COLLECTION).update_one(
+        {'_id': job_id, 'workerId': worker_id, 'status': 'running'},
+        {
+            '$set': {'status': 'queued', 'leaseExpiresAt': None, 'workerId': None, 'updatedAt': _now()},
+            '$inc': {'attempts': -1},
+        }
+    )
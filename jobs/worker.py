@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Callable
+from dotenv import load_dotenv
+from pymongo.asynchronous.database import AsyncDatabase
+from agents.scheduler import LLM_PRIORITY_NORMAL, llm_priority_var
+from db.checkpoints import delete_checkpoints
+from jobs.handlers import JOB_HANDLERS, JOB_LLM_PRIORITIES, LOW_PRIORITY_JOB_TYPES, NonRetryableJobError
+from jobs.queue import (
+    JOB_LEASE_SECONDS,
+    claim_next_job,
+    complete_job,
+    fail_job,
+    job_id_var,
+    release_job,
+    renew_lease,
+    update_progress,
+)
+from utils.log import configure_logging, request_id_var
+from utils.metrics import JOBS_IN_FLIGHT
+from utils.tracing import init_sentry, job_transaction
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_CONCURRENCY = int(os.getenv('JOB_WORKER_CONCURRENCY', '8'))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv('JOB_POLL_INTERVAL_SECONDS', '1'))
+JOB_LOW_PRIORITY_CONCURRENCY = int(os.getenv('JOB_LOW_PRIORITY_CONCURRENCY', '2'))
+
+
+class JobWorker:
+    """Claims jobs from the jobs collection and runs at most `concurrency` of them at a time,
+    of which at most `low_priority_concurrency` of a low priority type"""
+
+    def __init__(self, get_db: Callable[[], AsyncDatabase], concurrency: int = JOB_WORKER_CONCURRENCY, handlers: dict = None,
+                 low_priority_concurrency: int = JOB_LOW_PRIORITY_CONCURRENCY):
+        self.get_db = get_db
+        self.handlers = handlers or JOB_HANDLERS
+        self.low_priority_concurrency = low_priority_concurrency
+        self._low_priority_running = 0
+        self.worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wake_up = asyncio.Event()
+        self._running_tasks: set[asyncio.Task] = set()
+        self._loop_task: asyncio.Task | None = None
+        self._stopping = False
+
+    def start(self):
+        self._loop_task = asyncio.create_task(self._run())
+        logger.info("Job worker %s started", self.worker_id)
+
+    def notify(self):
+        """Wakes the poll loop early, used right after a job is enqueued by the same process"""
+        self._wake_up.set()
+
+    async def stop(self):
+        self._stopping = True
+        if self._loop_task:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+        for task in self._running_tasks:
+            task.cancel()
+        await asyncio.gather(*self._running_tasks, return_exceptions=True)
+        logger.info("Job worker %s stopped", self.worker_id)
+
+    async def _run(self):
+        while not self._stopping:
+            await self._slots.acquire()
+            try:
+                job = await claim_next_job(self.get_db(), self.worker_id, self._claimable_types())
+            except Exception:
+                logger.exception("Error claiming job")
+                job = None
+
+            if job is None:
+                self._slots.release()
+                self._wake_up.clear()
+                try:
+                    await asyncio.wait_for(self._wake_up.wait(), timeout=JOB_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            low_priority = job['type'] in LOW_PRIORITY_JOB_TYPES
+            if low_priority:
+                self._low_priority_running += 1
+            task = asyncio.create_task(self._execute(job, low_priority))
+            self._running_tasks.add(task)
+            task.add_done_callback(self._running_tasks.discard)
+
+    def _claimable_types(self) -> list[str]:
+        if self._low_priority_running < self.low_priority_concurrency:
+            return list(self.handlers)
+        return [job_type for job_type in self.handlers if job_type not in LOW_PRIORITY_JOB_TYPES]
+
+    async def _keep_lease(self, job: dict):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await renew_lease(self.get_db(), job['_id'], self.worker_id)
+            except Exception:
+                # Keep renewing, one missed renewal still leaves two thirds of the lease
+                logger.exception("Error renewing lease of job %s", job['_id'])
+
+    async def _discard_checkpoints(self, job: dict):
+        """Best effort, the TTL index removes whatever is left behind"""
+        try:
+            await delete_checkpoints(self.get_db(), str(job['_id']))
+        except Exception:
+            logger.exception("Error deleting graph checkpoints of job %s", job['_id'])
+
+    async def _execute(self, job: dict, low_priority: bool = False):
+        # Logs of the job carry the id of the request that queued it
+        request_id_var.set(job.get('requestId') or str(job['_id']))
+        llm_priority_var.set(JOB_LLM_PRIORITIES.get(job['type'], LLM_PRIORITY_NORMAL))
+        # Graph runs of the job checkpoint under its id, so a retry resumes where the last attempt stopped
+        job_id_var.set(str(job['_id']))
+        db = self.get_db()
+        heartbeat = asyncio.create_task(self._keep_lease(job))
+        in_flight = JOBS_IN_FLIGHT.labels(job['type'])
+        in_flight.inc()
+
+        async def on_progress(stage: str):
+            await update_progress(db, job['_id'], self.worker_id, stage)
+
+        try:
+            logger.info("Running %s job %s (attempt %s)", job['type'], job['_id'], job['attempts'])
+            with job_transaction(job):
+                result = await self.handlers[job['type']](db, job['payload'], on_progress)
+            await complete_job(db, job['_id'], self.worker_id, result)
+            await self._discard_checkpoints(job)
+        except asyncio.CancelledError:
+            await release_job(db, job['_id'], self.worker_id)
+            raise
+        except NonRetryableJobError as e:
+            await fail_job(db, job, self.worker_id, str(e), retryable=False)
+        except Exception as e:
+            logger.exception("Error running job %s", job['_id'])
+            await fail_job(db, job, self.worker_id, str(e))
+        finally:
+            heartbeat.cancel()
+            in_flight.dec()
+            if low_priority:
+                self._low_priority_running -= 1
+            self._slots.release()
+
+
+async def run_standalone_worker():
+    from db.mongo import connect_to_mongo, close_mongo_connection, get_database
+    from utils.tokens import warm_up_encoding
+
+    await asyncio.gather(connect_to_mongo(), warm_up_encoding())
+    worker = JobWorker(get_database)
+    worker.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await worker.stop()
+        await close_mongo_connection()
+
+
+if __name__ == '__main__':
+    configure_logging()
+    init_sentry()
+    try:
+        asyncio.run(run_standalone_worker())
+    except KeyboardInterrupt:
+        pass
@@ -1,31 +1,65 @@
-import sentry_sdk
-from langchain_core.messages import SystemMessage, HumanMessage
-from agents.exercise_checker_agent import exercise_checker, exercise_checker_system_prompt
-from graphs.lesson_generation_graph import LessonAgentState, lesson_generation_graph
-from models.Roadmap import Roadmap
-from bson import ObjectId
-import datetime
-from datetime import timezone
-from fastapi import FastAPI, HTTPException
+import logging
+from fastapi import FastAPI, HTTPException, Depends, Header, Query
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
-import json
-from pydantic import BaseModel
-from agents.lessons_planner_agent import plan_lessons
-from db.mongo import client
-from graphs.roadmap_generation_graph import RoadmapGenerationAgentState, RoadmapStatus, roadmap_generation_graph
-import uuid
+from starlette.responses import JSONResponse, StreamingResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, Field
+from agents.scheduler import LLM_PRIORITY_INTERACTIVE, LLMQueueTimeoutError, llm_priority_var
+from cache.llm_cache import llm_cache
+from db.indexes import ensure_indexes
+from db.mongo import connect_to_mongo, close_mongo_connection, get_database
+from db.serialization import serialize_document
+from jobs.queue import enqueue_job, find_active_job, get_job, serialize_job
+from jobs.worker import JobWorker
+from pymongo.asynchronous.database import AsyncDatabase
+from services.lesson_service import LessonGenerationParams, LessonNotFoundError, build_lesson_state, claim_prefetched_lesson, ensure_lesson_exists
+from services.lesson_stream import stream_lesson_events
+from services.prefetch_service import promote_prefetch_job, schedule_prefetch
+from services.roadmap_service import InvalidCursorError, get_roadmap, list_roadmap_summaries, plan_concept_lessons
+from services.idempotency import IdempotencyKeyInUseError, IdempotencyKeyReusedError, InvalidIdempotencyKeyError, run_idempotent
+from services.answer_service import ExerciseNotFoundError, InvalidAnswerError, check_exercise, check_exercises, check_with_llm
+from utils.executor import shutdown_executor
+from utils.log import RequestIdMiddleware, configure_logging, summarize
+from utils.metrics import PrometheusMiddleware
+from utils.tokens import warm_up_encoding
+from utils.tracing import init_sentry
+import asyncio
 import os
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Optional, Union
 
 load_dotenv()
 
-sentry_sdk.init(
-    dsn=os.getenv('SENTRY_DSN'),
-    send_default_pii=True,
-)
+configure_logging()
+logger = logging.getLogger(__name__)
+
+init_sentry()
+
+RUN_EMBEDDED_JOB_WORKER = os.getenv('RUN_EMBEDDED_JOB_WORKER', 'true').lower() == 'true'
+MONGO_ENSURE_INDEXES = os.getenv('MONGO_ENSURE_INDEXES', 'true').lower() == 'true'
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await asyncio.gather(connect_to_mongo(), warm_up_encoding())
+    if MONGO_ENSURE_INDEXES:
+        await ensure_indexes(get_database())
+    job_worker = JobWorker(get_database) if RUN_EMBEDDED_JOB_WORKER else None
+    if job_worker:
+        job_worker.start()
+    _app.state.job_worker = job_worker
+    yield
+    if job_worker:
+        await job_worker.stop()
+    await close_mongo_connection()
+    shutdown_executor()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(PrometheusMiddleware)
 
-app = FastAPI()
+app.add_middleware(RequestIdMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,94 +69,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _model_busy(e: LLMQueueTimeoutError) -> JSONResponse:
+    return JSONResponse(status_code=503, content={"error": str(e)}, headers={'Retry-After': str(round(e.retry_after))})
+
+
+@app.exception_handler(LLMQueueTimeoutError)
+async def model_busy_handler(_request, e: LLMQueueTimeoutError):
+    return _model_busy(e)
+
+
+def _notify_worker():
+    if app.state.job_worker:
+        app.state.job_worker.notify()
+
+
+async def _enqueue(db: AsyncDatabase, job_type: str, payload: dict) -> str:
+    job_id = await enqueue_job(db, job_type, payload)
+    _notify_worker()
+    return job_id
+
+
+async def _idempotent(db: AsyncDatabase, scope: str, key: Optional[str], payload: dict, handler: Callable[[], Awaitable[JSONResponse]]) -> JSONResponse:
+    """Honours the Idempotency-Key header, a repeated request gets the stored response"""
+    if key is None:
+        return await handler()
+    try:
+        return await run_idempotent(db, scope, key, payload, handler)
+    except InvalidIdempotencyKeyError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except IdempotencyKeyInUseError as e:
+        return JSONResponse(status_code=409, content={"error": str(e)})
+    except IdempotencyKeyReusedError as e:
+        return JSONResponse(status_code=422, content={"error": str(e)})
+
+
 class GenerateRoadmapRequest(BaseModel):
     topic: str
 
 @app.post('/generate-roadmap')
-async def generate_roadmap(request: GenerateRoadmapRequest):
-    """Generates roadmap, generates lessons meta, adds lessons to concept, inserts lessons to lessons collection"""
-    print(request.topic)
-    try:
-        initial_state = RoadmapGenerationAgentState(
-            roadmap_status=RoadmapStatus(),
-            topic=request.topic,
-            messages=[],
-            iteration=0
-        )
+async def generate_roadmap(request: GenerateRoadmapRequest, database: AsyncDatabase = Depends(get_database), idempotency_key: Optional[str] = Header(None)):
+    """Queues roadmap generation and returns the job id to poll"""
+    async def handle() -> JSONResponse:
+        logger.info("Queueing roadmap generation", extra={'topic': request.topic})
+        job_id = await _enqueue(database, 'roadmap', {'topic': request.topic})
+        return JSONResponse(status_code=202, content={"jobId": job_id, "status": 'queued'})
+
+    return await _idempotent(database, '/generate-roadmap', idempotency_key, request.model_dump(), handle)
 
-        roadmap = roadmap_generation_graph.invoke(initial_state)
-
-        print(roadmap)
-
-        database = client.get_database('prod')
-        roadmaps_col = database.get_collection('roadmaps')
-        lessons_col = database.get_collection('lessons')
-
-        last_message = roadmap['messages'][-1]
-        roadmap_content = json.loads(last_message.content)
-
-        sections_with_id = [
-            {
-                **section,
-                "_id": str(uuid.uuid4()),
-                'status': 'current' if i == 0 else 'locked',
-                'concepts': [
-                    {
-                        **concept,
-                        "_id": str(uuid.uuid4()),
-                        'status': 'current' if i == 0 and j == 0 else 'locked',
-                        'lessons': []
-                    }
-                    for j, concept in enumerate(section['concepts'])
-                ]
-            }
-            for i, section in enumerate(roadmap_content["sections"])
-        ]
-
-        first_concept_id = sections_with_id[0]['concepts'][0]['_id']
-
-        lessons = plan_lessons(
-            topic=roadmap_content['topic'],
-            section=sections_with_id[0]['title'],
-            concept=sections_with_id[0]['concepts'][0]['title']
-        )
-        lessons_dicts = [
-            {
-                **lesson.model_dump(),
-                'status': 'current' if i == 0 else 'locked',
-                'conceptId': first_concept_id
-            } for i, lesson in enumerate(lessons)]
-
-        try:
-            lessons_col.insert_many(lessons_dicts)
-        except Exception as e:
-            print(f'Error saving lessons: {e}')
-            raise
-
-        sections_with_id[0]['concepts'][0]['lessons'] = lessons_dicts
-
-        doc = {
-            'topic': roadmap_content['topic'],
-            'sections': sections_with_id,
-            'createdAt': datetime.datetime.now(timezone.utc),
-        }
-
-        roadmaps_col.insert_one(doc)
-        print("Roadmap saved successfully.")
-        return JSONResponse(status_code=201, content={"status": 'success'})
-    except Exception as e:
-        print("Error saving roadmap:", e)
-        return HTTPException(status_code=500, detail=f"Failed to generate roadmap: {e}")
+
+@app.get('/jobs/{job_id}')
+async def get_job_status(job_id: str, db: AsyncDatabase = Depends(get_database)):
+    job = await get_job(db, job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"error": "Job not found."})
+    return serialize_job(job)
 
 
 @app.get('/roadmaps')
-async def get_roadmaps():
-    db = client.get_database('prod')
-    collection = db.get_collection('roadmaps')
+async def get_roadmaps(
+        limit: int = Query(20, ge=1, le=100),
+        cursor: Optional[str] = None,
+        db: AsyncDatabase = Depends(get_database)
+):
+    """Roadmap summaries, newest first. Pass nextCursor back as cursor to get the next page"""
+    try:
+        page = await list_roadmap_summaries(db, limit, cursor)
+    except InvalidCursorError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return serialize_document(page)
 
-    roadmaps = list(collection.find())
-    print(roadmaps)
-    return {'roadmaps': roadmaps}
+
+@app.get('/roadmaps/{roadmap_id}')
+async def get_roadmap_detail(roadmap_id: str, db: AsyncDatabase = Depends(get_database)):
+    roadmap = await get_roadmap(db, roadmap_id)
+    if not roadmap:
+        return JSONResponse(status_code=404, content={"error": "Roadmap not found."})
+    return serialize_document(roadmap)
 
 
 class LessonRequest(BaseModel):
@@ -134,75 +156,53 @@ class LessonRequest(BaseModel):
     lessonId: str
 
 @app.post("/lesson")
-async def generate_lesson(request: LessonRequest):
+async def generate_lesson(request: LessonRequest, db: AsyncDatabase = Depends(get_database)):
+    """Queues lesson generation and returns the job id to poll, or answers right away when the lesson was prefetched"""
+    params = LessonGenerationParams(**request.model_dump())
     try:
-        db = client.get_database("prod")
-        roadmaps_col = db.get_collection("roadmaps")
-        lessons_col = db.get_collection("lessons")
-
-        roadmap_data = roadmaps_col.find_one({"_id": ObjectId(request.roadmapId)})
-        lesson_data = lessons_col.find_one({'_id': ObjectId(request.lessonId)})
-        lesson_titles = [lesson['title'] for lesson in lessons_col.find(
-            {'conceptId': request.conceptId},
-            {'title': 1, '_id': 0}
-        )]
-
-        if not roadmap_data:
-            return JSONResponse(status_code=404, content={"error": "Roadmap not found."})
-        if not lesson_data:
-            return JSONResponse(status_code=404, content={"error": "Lesson not found."})
-
-        initial_state = LessonAgentState(
-            roadmap=Roadmap(**roadmap_data),
-            learned_summary="",
-            current_section_title=request.sectionTitle,
-            current_concept_title=request.conceptTitle,
-            lesson=None,
-            lesson_title=lesson_data['title'],
-            learning_objectives=lesson_data['learning_objectives'],
-            lessons_in_concept=lesson_titles
-        )
+        await ensure_lesson_exists(db, params)
+    except LessonNotFoundError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+
+    if await claim_prefetched_lesson(db, params.lessonId):
+        await schedule_prefetch(db, params)
+        return JSONResponse(status_code=200, content={"jobId": None, "status": 'succeeded', "lesson_id": request.lessonId})
+
+    job_id = await promote_prefetch_job(db, params.lessonId)
+    if job_id:
+        _notify_worker()
+    else:
+        # A double click or a second tab gets the job that is already generating the lesson
+        job_id = await find_active_job(db, 'lesson', {'lessonId': params.lessonId}) or await _enqueue(db, 'lesson', request.model_dump())
+    return JSONResponse(status_code=202, content={"jobId": job_id, "status": 'queued', "lesson_id": request.lessonId})
+
+
+@app.post("/lesson/stream")
+async def stream_lesson(request: LessonRequest, db: AsyncDatabase = Depends(get_database)):
+    """Generates the lesson while streaming content deltas and then the exercises as server-sent events"""
+    llm_priority_var.set(LLM_PRIORITY_INTERACTIVE)
+    params = LessonGenerationParams(**request.model_dump())
+    try:
+        initial_state = await build_lesson_state(db, params)
+    except LessonNotFoundError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+
+    return StreamingResponse(
+        stream_lesson_events(db, params, initial_state),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-        result_dict = lesson_generation_graph.invoke(initial_state)
-        lesson_state = LessonAgentState(**result_dict)
-
-        if not lesson_state.lesson:
-            return JSONResponse(status_code=500, content={"error": "No lesson generated"})
-
-        lesson_dict = lesson_state.lesson.model_dump()
-
-        exercises_data = []
-        for exercise in lesson_dict['exercises']:
-            exercise_data = {
-                'type': exercise['type'],
-                'question': exercise['exercise']['question']
-            }
-            if exercise['type'] == 'mcq':
-                exercise_data['answer_options'] = exercise['exercise']['answer_options']
-                exercise_data['answer_index'] = exercise['exercise']['answer_index']
-            exercises_data.append(exercise_data)
-
-        update_result = lessons_col.update_one(
-            {'_id': ObjectId(request.lessonId)},
-            {'$set': {
-                'content': lesson_dict['content'],
-                'exercises': exercises_data,
-                'summary': lesson_dict['summary'],
-                'is_final': lesson_dict['is_final'],
-                'conceptId': request.conceptId,
-                'createdAt': datetime.datetime.now(),
-                'status': 'current'
-            }}
-        )
 
-        if update_result.modified_count == 0:
-            return JSONResponse(status_code=500, content={"error": "Failed to update lesson"})
+@app.get('/metrics')
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-        return {"message": "Lesson generated successfully", "lesson_id": request.lessonId}
 
-    except Exception as e:
-        print("Error in /lesson endpoint:", e)
-        return JSONResponse(status_code=500, content={"error": f"Error generating lesson: {str(e)}"})
+@app.get('/cache/stats')
+async def get_cache_stats():
+    """Hit/miss counters of the LLM response cache per agent and tier"""
+    return llm_cache.stats()
 
 
 class AnswerCheckRequest(BaseModel):
@@ -213,29 +213,71 @@ class AnswerCheckRequest(BaseModel):
 
 @app.post('/check-answer')
 async def check_answer(request: AnswerCheckRequest):
-    print('Checking answer...')
+    logger.info("Checking answer")
+    llm_priority_var.set(LLM_PRIORITY_INTERACTIVE)
     try:
-
-        user_prompt = f"""
-            Question: {request.question}\n\n
-            User's answer: {request.answer}\n\n
-            Lesson Content: {request.lessonContent}
-        """
-
-        answer = exercise_checker.invoke(
-            [
-                SystemMessage(content=exercise_checker_system_prompt),
-                HumanMessage(content=user_prompt)
-            ]
-        )
-        print(answer)
+        answer = await check_with_llm(request.question, request.answer, request.lessonContent)
+        logger.debug("Answer checked: %s", summarize(answer))
         return answer.model_dump()
 
+    except LLMQueueTimeoutError as e:
+        return _model_busy(e)
+    except Exception as e:
+        logger.exception("Error checking answer")
+        raise HTTPException(status_code=500, detail=f"Error processing answer: {str(e)}")
+
+
+class ExerciseAnswerRequest(BaseModel):
+    answer: Union[int, str]
+    explain: bool = False
+
+
+@app.post('/lessons/{lesson_id}/exercises/{exercise_index}/check')
+async def check_exercise_answer(lesson_id: str, exercise_index: int, request: ExerciseAnswerRequest, db: AsyncDatabase = Depends(get_database)):
+    """Grades MCQs from the stored answer_index and open questions against the stored lesson content"""
+    llm_priority_var.set(LLM_PRIORITY_INTERACTIVE)
+    try:
+        return await check_exercise(db, lesson_id, exercise_index, request.answer, request.explain)
+    except ExerciseNotFoundError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+    except InvalidAnswerError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except LLMQueueTimeoutError as e:
+        return _model_busy(e)
     except Exception as e:
-        print(e)
+        logger.exception("Error checking exercise answer")
         raise HTTPException(status_code=500, detail=f"Error processing answer: {str(e)}")
 
 
+class ExerciseAnswer(BaseModel):
+    exerciseIndex: int
+    answer: Union[int, str]
+
+
+class ExerciseAnswersRequest(BaseModel):
+    lessonId: str
+    answers: List[ExerciseAnswer] = Field(min_length=1)
+    explain: bool = False
+
+
+@app.post('/check-answers')
+async def check_answers(request: ExerciseAnswersRequest, db: AsyncDatabase = Depends(get_database)):
+    """Grades all answers to a lesson's exercises, the open questions with a single exercise checker call"""
+    llm_priority_var.set(LLM_PRIORITY_INTERACTIVE)
+    try:
+        results = await check_exercises(db, request.lessonId, [(answer.exerciseIndex, answer.answer) for answer in request.answers], request.explain)
+        return {"results": results}
+    except ExerciseNotFoundError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+    except InvalidAnswerError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except LLMQueueTimeoutError as e:
+        return _model_busy(e)
+    except Exception as e:
+        logger.exception("Error checking exercise answers")
+        raise HTTPException(status_code=500, detail=f"Error processing answers: {str(e)}")
+
+
 class PlanLessonsRequest(BaseModel):
     roadmap_topic: str
     section_title: str
@@ -246,39 +288,17 @@ class PlanLessonsRequest(BaseModel):
 
 
 @app.post('/plan-lessons')
-async def plan_lessons_for_concept(request: PlanLessonsRequest):
-    print('Planning lessons...')
-    lessons = plan_lessons(
-        topic=request.roadmap_topic,
-        section=request.section_title,
-        concept=request.concept_title
-    )
-
-    db = client.get_database('prod')
-    lessons_col = db.get_collection('lessons')
-    roadmaps_col = db.get_collection('roadmaps')
-
-    lessons_dicts = [{**lesson.model_dump(),
-                      'status': 'locked',
-                      'conceptId': request.concept_id} for lesson in
-                     lessons]
-    lessons_dicts[0]['status'] = 'current'
-
-    try:
-        lessons_col.insert_many(lessons_dicts)
-        roadmaps_col.find_one_and_update(
-            {'_id': ObjectId(request.roadmap_id)},
-            {
-                '$set': {
-                    "sections.$[section].concepts.$[concept].lessons": lessons_dicts
-                }
-            },
-            array_filters=[
-                {"section._id": request.section_id},
-                {"concept._id": request.concept_id}
-            ]
+async def plan_lessons_for_concept(request: PlanLessonsRequest, db: AsyncDatabase = Depends(get_database), idempotency_key: Optional[str] = Header(None)):
+    async def handle() -> JSONResponse:
+        await plan_concept_lessons(
+            db,
+            roadmap_id=request.roadmap_id,
+            section_id=request.section_id,
+            concept_id=request.concept_id,
+            topic=request.roadmap_topic,
+            section_title=request.section_title,
+            concept_title=request.concept_title,
         )
-        return {'message': 'Lessons planned successfully'}
-    except Exception as e:
-        print(f'Error saving lessons: {e}')
-        raise
+        return JSONResponse(status_code=200, content={'message': 'Lessons planned successfully'})
+
+    return await _idempotent(db, '/plan-lessons', idempotency_key, request.model_dump(), handle)
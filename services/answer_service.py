@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from typing import List, Tuple, Union
+from bson import ObjectId
+from bson.errors import InvalidId
+from langchain_core.messages import SystemMessage, HumanMessage
+from pymongo.asynchronous.database import AsyncDatabase
+from agents.exercise_checker_agent import (
+    Answer,
+    batch_exercise_checker,
+    batch_exercise_checker_system_prompt,
+    exercise_checker,
+    exercise_checker_system_prompt,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ExerciseNotFoundError(Exception):
+    """Raised when the lesson or the exercise index being checked does not exist"""
+
+
+class InvalidAnswerError(Exception):
+    """Raised when an MCQ answer does not point at one of the answer options"""
+
+
+async def check_with_llm(question: str, answer: str, lesson_content: str) -> Answer:
+    user_prompt = f"""
+        Question: {question}\n\n
+        User's answer: {answer}\n\n
+        Lesson Content: {lesson_content}
+    """
+
+    return await exercise_checker.ainvoke(
+        [
+            SystemMessage(content=exercise_checker_system_prompt),
+            HumanMessage(content=user_prompt)
+        ]
+    )
+
+
+async def explain_mcq(exercise: dict, chosen_index: int, is_correct: bool, lesson_content: str) -> str:
+    """Explains the grade an MCQ answer already got, the model sees the options and the correct one so it cannot contradict it"""
+    options = "\n".join(f"{i + 1}. {option}" for i, option in enumerate(exercise['answer_options']))
+    question = f"""{exercise['question']}\n
+        Answer options:\n{options}\n
+        Correct answer: {exercise['answer_options'][exercise['answer_index']]}\n
+        The user's answer has already been graded as {'correct' if is_correct else 'incorrect'}. Do not grade it again,
+        explain why it is {'correct' if is_correct else 'incorrect'}{'' if is_correct else ' and why the correct answer is right'}.
+    """
+    explanation = await check_with_llm(question, exercise['answer_options'][chosen_index], lesson_content)
+    return explanation.additional_explanation
+
+
+async def check_with_llm_batch(questions: List[Tuple[int, str, str]], lesson_content: str) -> dict[int, Answer]:
+    """Checks (exercise_index, question, answer) triples in one call with a single copy of the lesson content.
+    Exercises the model left out of its answer are checked one by one"""
+    if not questions:
+        return {}
+    exercises = "\n\n".join(
+        f"Exercise Index: {index}\nQuestion: {question}\nUser's answer: {answer}"
+        for index, question, answer in questions
+    )
+    # The lesson content goes first so that checks of the same lesson share a prompt prefix
+    user_prompt = f"""
+        Lesson Content: {lesson_content}\n\n
+        {exercises}
+    """
+
+    result = await batch_exercise_checker.ainvoke(
+        [
+            SystemMessage(content=batch_exercise_checker_system_prompt),
+            HumanMessage(content=user_prompt)
+        ]
+    )
+    answers = {answer.exercise_index: Answer(is_correct=answer.is_correct, additional_explanation=answer.additional_explanation) for answer in result.answers}
+
+    missing = [(index, question, answer) for index, question, answer in questions if index not in answers]
+    if missing:
+        logger.warning("Batch check left out %s of %s exercises", len(missing), len(questions))
+        checked = await asyncio.gather(*(check_with_llm(question, answer, lesson_content) for _, question, answer in missing))
+        answers.update({index: answer for (index, _, _), answer in zip(missing, checked)})
+    return answers
+
+
+async def load_gradable_lesson(db: AsyncDatabase, lesson_id: str) -> dict:
+    try:
+        object_id = ObjectId(lesson_id)
+    except InvalidId:
+        raise ExerciseNotFoundError("Lesson not found.")
+
+    lesson = await db.get_collection('lessons').find_one({'_id': object_id}, {'content': 1, 'exercises': 1})
+    if not lesson or not lesson.get('exercises'):
+        raise ExerciseNotFoundError("Lesson not found.")
+    return lesson
+
+
+def get_exercise(lesson: dict, exercise_index: int) -> dict:
+    if not 0 <= exercise_index < len(lesson['exercises']):
+        raise ExerciseNotFoundError("Exercise not found.")
+    return lesson['exercises'][exercise_index]
+
+
+def resolve_option_index(exercise: dict, answer: Union[int, str]) -> int:
+    """Accepts either the option index or the option text"""
+    options = exercise['answer_options']
+    if isinstance(answer, int):
+        if 0 <= answer < len(options):
+            return answer
+    else:
+        normalized = answer.strip().casefold()
+        for i, option in enumerate(options):
+            if option.strip().casefold() == normalized:
+                return i
+    raise InvalidAnswerError("Answer is not one of the answer options.")
+
+
+def _grade_mcq(exercise: dict, chosen_index: int) -> dict:
+    return {
+        'is_correct': chosen_index == exercise['answer_index'],
+        'additional_explanation': '',
+        'correct_index': exercise['answer_index'],
+    }
+
+
+async def grade_exercise(lesson: dict, exercise: dict, answer: Union[int, str], explain: bool = False) -> dict:
+    """MCQs are graded from the stored answer_index, open questions go to the exercise checker"""
+    if exercise['type'] == 'mcq':
+        chosen_index = resolve_option_index(exercise, answer)
+        result = _grade_mcq(exercise, chosen_index)
+        if explain:
+            # The prompt only depends on the chosen option, so the LLM cache keeps one explanation per option
+            result['additional_explanation'] = await explain_mcq(exercise, chosen_index, result['is_correct'], lesson.get('content', ''))
+        return result
+
+    answer = await check_with_llm(exercise['question'], str(answer), lesson.get('content', ''))
+    return answer.model_dump()
+
+
+async def check_exercise(db: AsyncDatabase, lesson_id: str, exercise_index: int, answer: Union[int, str], explain: bool = False) -> dict:
+    lesson = await load_gradable_lesson(db, lesson_id)
+    exercise = get_exercise(lesson, exercise_index)
+    return await grade_exercise(lesson, exercise, answer, explain)
+
+
+async def check_exercises(db: AsyncDatabase, lesson_id: str, answers: List[Tuple[int, Union[int, str]]], explain: bool = False) -> List[dict]:
+    """Grades (exercise_index, answer) pairs of one lesson. MCQs are graded locally, all open questions go to the
+    exercise checker together in a single call. Results keep the order of the answers"""
+    lesson = await load_gradable_lesson(db, lesson_id)
+    lesson_content = lesson.get('content', '')
+
+    results = {}
+    to_check = []
+    to_explain = []
+    for exercise_index, answer in answers:
+        if exercise_index in results:
+            raise InvalidAnswerError(f"Exercise {exercise_index} is answered more than once.")
+        exercise = get_exercise(lesson, exercise_index)
+        if exercise['type'] == 'mcq':
+            chosen_index = resolve_option_index(exercise, answer)
+            results[exercise_index] = _grade_mcq(exercise, chosen_index)
+            if explain:
+                to_explain.append((exercise_index, exercise, chosen_index))
+        else:
+            results[exercise_index] = None
+            to_check.append((exercise_index, exercise['question'], str(answer)))
+
+    # Explanations are cached per option, so they run as separate calls next to the batch of open questions
+    checked, *explanations = await asyncio.gather(
+        check_with_llm_batch(to_check, lesson_content),
+        *(explain_mcq(exercise, chosen_index, results[exercise_index]['is_correct'], lesson_content) for exercise_index, exercise, chosen_index in to_explain)
+    )
+    for exercise_index, _, _ in to_check:
+        results[exercise_index] = checked[exercise_index].model_dump()
+    for (exercise_index, _, _), explanation in zip(to_explain, explanations):
+        results[exercise_index]['additional_explanation'] = explanation
+
+    return [{'exercise_index': exercise_index, **results[exercise_index]} for exercise_index, _ in answers]
@@ -0,0 +1,102 @@
+import datetime
+import hashlib
+import json
+import os
+from datetime import timezone
+from typing import Awaitable, Callable, Optional
+from dotenv import load_dotenv
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import DuplicateKeyError
+from starlette.responses import JSONResponse
+
+load_dotenv()
+
+IDEMPOTENCY_COLLECTION = 'idempotency_keys'
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+# A key whose request never finished (e.g. the process died) is freed after this long
+IDEMPOTENCY_IN_PROGRESS_SECONDS = int(os.getenv('IDEMPOTENCY_IN_PROGRESS_SECONDS', '300'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+class InvalidIdempotencyKeyError(Exception):
+    """Raised when the Idempotency-Key header is empty or too long"""
+
+
+class IdempotencyKeyInUseError(Exception):
+    """Raised while the first request with the same key is still running"""
+
+
+class IdempotencyKeyReusedError(Exception):
+    """Raised when a key is sent again with a different request body"""
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(timezone.utc)
+
+
+def request_fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+async def _begin(db: AsyncDatabase, record_id: str, fingerprint: str) -> Optional[dict]:
+    """Claims the key for this request, returns the stored record instead when the key was used before"""
+    keys_col = db.get_collection(IDEMPOTENCY_COLLECTION)
+    while True:
+        now = _now()
+        claim = {
+            'status': 'in_progress',
+            'fingerprint': fingerprint,
+            'createdAt': now,
+            'expiresAt': now + datetime.timedelta(seconds=IDEMPOTENCY_IN_PROGRESS_SECONDS),
+        }
+        try:
+            # Expired records can linger until the TTL monitor runs, those are taken over
+            await keys_col.update_one({'_id': record_id, 'expiresAt': {'$lte': now}}, {'$set': claim}, upsert=True)
+            return None
+        except DuplicateKeyError:
+            record = await keys_col.find_one({'_id': record_id})
+        if record is not None:
+            return record
+        # The request holding the key failed and freed it in the meantime, try to claim it again
+
+
+async def run_idempotent(db: AsyncDatabase, scope: str, key: str, payload: dict, handler: Callable[[], Awaitable[JSONResponse]]) -> JSONResponse:
+    """Runs the handler once per key and scope. Repeats get the stored response, unless it failed with a 5xx,
+    in which case the key is freed so the request can be retried"""
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise InvalidIdempotencyKeyError(f"Idempotency-Key must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters.")
+
+    record_id = f"{scope}:{key}"
+    fingerprint = request_fingerprint(payload)
+    keys_col = db.get_collection(IDEMPOTENCY_COLLECTION)
+
+    record = await _begin(db, record_id, fingerprint)
+    if record is not None:
+        if record['fingerprint'] != fingerprint:
+            raise IdempotencyKeyReusedError("Idempotency-Key was already used for a different request.")
+        if record['status'] == 'in_progress':
+            raise IdempotencyKeyInUseError("A request with this Idempotency-Key is still in progress.")
+        return JSONResponse(status_code=record['statusCode'], content=record['body'], headers={REPLAYED_HEADER: 'true'})
+
+    try:
+        response = await handler()
+    except BaseException:
+        await keys_col.delete_one({'_id': record_id, 'status': 'in_progress'})
+        raise
+
+    if response.status_code >= 500:
+        await keys_col.delete_one({'_id': record_id, 'status': 'in_progress'})
+        return response
+
+    await keys_col.update_one(
+        {'_id': record_id},
+        {'$set': {
+            'status': 'completed',
+            'statusCode': response.status_code,
+            'body': json.loads(response.body),
+            'expiresAt': _now() + datetime.timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+        }}
+    )
+    return response
@@ -0,0 +1,156 @@
+import asyncio
+import datetime
+from typing import Optional
+import sentry_sdk
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import BaseModel
+from pymongo.asynchronous.database import AsyncDatabase
+from graphs.lesson_generation_graph import LessonAgentState, lesson_generation_graph
+from graphs.runner import run_graph, ProgressCallback
+from models.Lesson import Lesson
+from models.Roadmap import Roadmap
+from utils.single_flight import SingleFlight
+
+# Concurrent generations of the same lesson, in this or another process, share one run of the graph
+lesson_generation = SingleFlight('lesson')
+
+
+class LessonNotFoundError(Exception):
+    """Raised when the roadmap or lesson a generation refers to does not exist"""
+
+
+class LessonGenerationParams(BaseModel):
+    roadmapId: str
+    roadmapTitle: str
+    sectionTitle: str
+    conceptTitle: str
+    conceptId: str
+    lessonId: str
+
+
+def _object_id(value: str, name: str) -> ObjectId:
+    try:
+        return ObjectId(value)
+    except InvalidId:
+        raise LessonNotFoundError(f"{name} not found.")
+
+
+async def ensure_lesson_exists(db: AsyncDatabase, params: LessonGenerationParams):
+    """Fails before a job is queued for a roadmap or lesson that does not exist"""
+    roadmap_id = _object_id(params.roadmapId, "Roadmap")
+    lesson_id = _object_id(params.lessonId, "Lesson")
+    roadmap_count, lesson_count = await asyncio.gather(
+        db.get_collection("roadmaps").count_documents({'_id': roadmap_id}, limit=1),
+        db.get_collection("lessons").count_documents({'_id': lesson_id}, limit=1)
+    )
+    if not roadmap_count:
+        raise LessonNotFoundError("Roadmap not found.")
+    if not lesson_count:
+        raise LessonNotFoundError("Lesson not found.")
+
+
+async def build_lesson_state(db: AsyncDatabase, params: LessonGenerationParams) -> LessonAgentState:
+    roadmaps_col = db.get_collection("roadmaps")
+    lessons_col = db.get_collection("lessons")
+
+    roadmap_id = _object_id(params.roadmapId, "Roadmap")
+    lesson_id = _object_id(params.lessonId, "Lesson")
+    with sentry_sdk.start_span(op='lesson.load_context', name='Load roadmap and lessons'):
+        roadmap_data, lesson_data, lesson_docs = await asyncio.gather(
+            roadmaps_col.find_one({"_id": roadmap_id}),
+            lessons_col.find_one({'_id': lesson_id}),
+            lessons_col.find({'conceptId': params.conceptId}, {'title': 1, '_id': 0}).sort('order', 1).to_list()
+        )
+    lesson_titles = [lesson['title'] for lesson in lesson_docs]
+
+    if not roadmap_data:
+        raise LessonNotFoundError("Roadmap not found.")
+    if not lesson_data:
+        raise LessonNotFoundError("Lesson not found.")
+
+    return LessonAgentState(
+        roadmap=Roadmap(**roadmap_data),
+        learned_summary="",
+        current_section_title=params.sectionTitle,
+        current_concept_title=params.conceptTitle,
+        lesson=None,
+        lesson_title=lesson_data['title'],
+        learning_objectives=lesson_data['learning_objectives'],
+        lessons_in_concept=lesson_titles
+    )
+
+
+async def save_lesson(db: AsyncDatabase, params: LessonGenerationParams, lesson: Lesson, speculative: bool = False):
+    """Stores the generated lesson, a speculative one is kept locked until the learner opens it"""
+    lessons_col = db.get_collection("lessons")
+    lesson_dict = lesson.model_dump()
+
+    exercises_data = []
+    for exercise in lesson_dict['exercises']:
+        exercise_data = {
+            'type': exercise['type'],
+            'question': exercise['exercise']['question']
+        }
+        if exercise['type'] == 'mcq':
+            exercise_data['answer_options'] = exercise['exercise']['answer_options']
+            exercise_data['answer_index'] = exercise['exercise']['answer_index']
+        exercises_data.append(exercise_data)
+
+    update = {
+        'content': lesson_dict['content'],
+        'exercises': exercises_data,
+        'summary': lesson_dict['summary'],
+        'is_final': lesson_dict['is_final'],
+        'conceptId': params.conceptId,
+        'createdAt': datetime.datetime.now(),
+        'prefetched': speculative,
+    }
+    if not speculative:
+        update['status'] = 'current'
+
+    update_result = await lessons_col.update_one({'_id': ObjectId(params.lessonId)}, {'$set': update})
+
+    if update_result.modified_count == 0:
+        raise RuntimeError("Failed to update lesson")
+
+
+async def is_lesson_generated(db: AsyncDatabase, lesson_id: str) -> bool:
+    return await db.get_collection("lessons").count_documents({'_id': ObjectId(lesson_id), 'content': {'$exists': True}}, limit=1) > 0
+
+
+async def load_generated_lesson(db: AsyncDatabase, lesson_id: str) -> Optional[dict]:
+    return {"lesson_id": lesson_id} if await is_lesson_generated(db, lesson_id) else None
+
+
+async def claim_prefetched_lesson(db: AsyncDatabase, lesson_id: str, only_opened: bool = False) -> bool:
+    """Unlocks a lesson that was generated ahead of time, False when there is none to hand out.
+    With only_opened, only a lesson the learner already opened while it was being prefetched is claimed"""
+    query = {'_id': ObjectId(lesson_id), 'prefetched': True, 'content': {'$exists': True}}
+    if only_opened:
+        query['status'] = 'current'
+    result = await db.get_collection("lessons").update_one(
+        query,
+        {'$set': {'status': 'current', 'prefetched': False}}
+    )
+    return result.modified_count == 1
+
+
+async def generate_and_save_lesson(db: AsyncDatabase, params: LessonGenerationParams, on_progress: Optional[ProgressCallback] = None, speculative: bool = False) -> dict:
+    async def generate() -> dict:
+        initial_state = await build_lesson_state(db, params)
+
+        result_dict = await run_graph(lesson_generation_graph, initial_state, on_progress, db)
+        lesson_state = LessonAgentState(**result_dict)
+
+        if not lesson_state.lesson:
+            raise RuntimeError("No lesson generated")
+
+        await save_lesson(db, params, lesson_state.lesson, speculative)
+        return {"lesson_id": params.lessonId}
+
+    result = await lesson_generation.run(db, params.lessonId, generate, lambda: load_generated_lesson(db, params.lessonId))
+    if not speculative:
+        # The run that was joined may have been a prefetch, which leaves the lesson locked
+        await claim_prefetched_lesson(db, params.lessonId)
+    return result
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator
+from bson import ObjectId
+from langchain_core.utils.json import parse_partial_json
+from pymongo.asynchronous.database import AsyncDatabase
+from graphs.lesson_generation_graph import LessonAgentState, lesson_generation_graph
+from services.lesson_service import LessonGenerationParams, claim_prefetched_lesson, lesson_generation, load_generated_lesson, save_lesson
+from services.prefetch_service import schedule_prefetch
+
+logger = logging.getLogger(__name__)
+
+GENERATOR_NODE = 'lesson_generator_node'
+_STREAM_END = object()
+_producers: set[asyncio.Task] = set()
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _chunk_text(chunk) -> str:
+    """Raw JSON text of a structured-output chunk, whether it arrives as content or as tool call args"""
+    if isinstance(chunk.content, str) and chunk.content:
+        return chunk.content
+    return ''.join(tool_chunk.get('args') or '' for tool_chunk in getattr(chunk, 'tool_call_chunks', []))
+
+
+class _ContentExtractor:
+    """Pulls the growing `content` field out of the partial Lesson JSON the generator streams"""
+
+    def __init__(self):
+        self.buffer = ''
+        self.sent = ''
+
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        try:
+            partial = parse_partial_json(self.buffer)
+        except Exception:
+            return ''
+        content = partial.get('content') if isinstance(partial, dict) else None
+        if not isinstance(content, str) or not content.startswith(self.sent):
+            return ''
+        delta = content[len(self.sent):]
+        self.sent = content
+        return delta
+
+
+def _stored_exercise(exercise: dict) -> dict:
+    """Turns an exercise as saved in the lessons collection back into the shape the generator streams"""
+    return {'type': exercise['type'], 'exercise': {key: value for key, value in exercise.items() if key != 'type'}}
+
+
+async def _send_saved_lesson(db: AsyncDatabase, lesson_id: str, queue: asyncio.Queue):
+    lesson = await db.get_collection('lessons').find_one({'_id': ObjectId(lesson_id)}, {'content': 1, 'exercises': 1})
+    await queue.put(_sse('content', {'delta': lesson['content']}))
+    await queue.put(_sse('exercises', {'exercises': [_stored_exercise(exercise) for exercise in lesson.get('exercises', [])]}))
+
+
+async def _produce(db: AsyncDatabase, params: LessonGenerationParams, initial_state: LessonAgentState, queue: asyncio.Queue):
+    """Runs the graph and persists the lesson; keeps going even if the client disconnects.
+    A prefetched lesson is sent as saved, and when the lesson is already being generated elsewhere,
+    waits for it and sends the saved lesson in one piece"""
+    streamed = False
+
+    async def generate() -> dict:
+        nonlocal streamed
+        streamed = True
+        await _stream_generation(db, params, initial_state, queue)
+        return {"lesson_id": params.lessonId}
+
+    try:
+        if await claim_prefetched_lesson(db, params.lessonId):
+            # Generated ahead of time, nothing left to generate
+            await _send_saved_lesson(db, params.lessonId, queue)
+            await queue.put(_sse('done', {'lesson_id': params.lessonId}))
+            await schedule_prefetch(db, params)
+            return
+
+        await lesson_generation.run(db, params.lessonId, generate, lambda: load_generated_lesson(db, params.lessonId))
+        if not streamed:
+            await claim_prefetched_lesson(db, params.lessonId)
+            await _send_saved_lesson(db, params.lessonId, queue)
+        await queue.put(_sse('done', {'lesson_id': params.lessonId}))
+        await schedule_prefetch(db, params)
+    except Exception as e:
+        logger.exception("Error in /lesson/stream")
+        await queue.put(_sse('error', {'error': f"Error generating lesson: {str(e)}"}))
+    finally:
+        await queue.put(_STREAM_END)
+
+
+async def _stream_generation(db: AsyncDatabase, params: LessonGenerationParams, initial_state: LessonAgentState, queue: asyncio.Queue):
+    extractor = None
+    streaming_run = None
+    final_state = None
+
+    async for event in lesson_generation_graph.astream_events(initial_state, version='v2'):
+        kind = event['event']
+        node = event.get('metadata', {}).get('langgraph_node')
+
+        if kind == 'on_chat_model_start' and node == GENERATOR_NODE:
+            if streaming_run is not None:
+                # A hedged call racing the one being streamed, the final content is sent if it wins
+                continue
+            if extractor and extractor.sent:
+                await queue.put(_sse('reset', {'reason': 'regenerating'}))
+            extractor = _ContentExtractor()
+            streaming_run = event['run_id']
+        elif kind == 'on_chat_model_stream' and event['run_id'] == streaming_run:
+            delta = extractor.feed(_chunk_text(event['data']['chunk']))
+            if delta:
+                await queue.put(_sse('content', {'delta': delta}))
+        elif kind == 'on_chat_model_end' and event['run_id'] == streaming_run:
+            streaming_run = None
+        elif kind == 'on_chain_end' and event.get('name') == GENERATOR_NODE:
+            # The streamed call may have lost the race or failed over, in which case it never ends
+            streaming_run = None
+        elif kind == 'on_chain_end' and not event.get('parent_ids'):
+            final_state = event['data']['output']
+
+    lesson_state = LessonAgentState(**final_state) if final_state else None
+    if not lesson_state or not lesson_state.lesson:
+        raise RuntimeError("No lesson generated")
+
+    lesson = lesson_state.lesson
+    if not extractor or extractor.sent != lesson.content:
+        # Nothing (or a stale draft) was streamed, so send the final markdown in one piece
+        await queue.put(_sse('reset', {'reason': 'final'}))
+        await queue.put(_sse('content', {'delta': lesson.content}))
+
+    await queue.put(_sse('exercises', {'exercises': [exercise.model_dump() for exercise in lesson.exercises]}))
+
+    await save_lesson(db, params, lesson)
+
+
+async def stream_lesson_events(db: AsyncDatabase, params: LessonGenerationParams, initial_state: LessonAgentState) -> AsyncIterator[str]:
+    queue: asyncio.Queue = asyncio.Queue()
+    producer = asyncio.create_task(_produce(db, params, initial_state, queue))
+    _producers.add(producer)
+    producer.add_done_callback(_producers.discard)
+
+    while True:
+        message = await queue.get()
+        if message is _STREAM_END:
+            break
+        yield message
+
+    await producer
@@ -0,0 +1,130 @@
+import logging
+import os
+from typing import Optional
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo.asynchronous.database import AsyncDatabase
+from jobs.queue import JOBS_COLLECTION, JOB_PRIORITY_LOW, JOB_PRIORITY_NORMAL, enqueue_job
+from services.lesson_service import LessonGenerationParams, claim_prefetched_lesson
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LESSON_PREFETCH_ENABLED = os.getenv('LESSON_PREFETCH_ENABLED', 'true').lower() == 'true'
+# Speculative generations per roadmap that may be outstanding, queued or running jobs and lessons nobody opened yet
+LESSON_PREFETCH_BUDGET_PER_ROADMAP = int(os.getenv('LESSON_PREFETCH_BUDGET_PER_ROADMAP', '10'))
+
+PREFETCH_JOB_TYPE = 'lesson_prefetch'
+
+ROADMAP_OUTLINE_PROJECTION = {
+    'sections.title': 1,
+    'sections.concepts._id': 1,
+    'sections.concepts.title': 1,
+    'sections.concepts.lessonIds': 1,
+}
+
+
+def next_lessons(roadmap: dict, params: LessonGenerationParams) -> list[LessonGenerationParams]:
+    """The lesson after the current one in its concept and the first lesson of the next concept, where they are planned"""
+    concepts = [(section, concept) for section in roadmap.get('sections', []) for concept in section['concepts']]
+    for i, (_section, concept) in enumerate(concepts):
+        if concept['_id'] != params.conceptId:
+            continue
+
+        targets = []
+        lesson_ids = [str(lesson_id) for lesson_id in concept.get('lessonIds', [])]
+        if params.lessonId in lesson_ids:
+            position = lesson_ids.index(params.lessonId)
+            if position + 1 < len(lesson_ids):
+                targets.append(params.model_copy(update={'lessonId': lesson_ids[position + 1]}))
+
+        if i + 1 < len(concepts):
+            next_section, next_concept = concepts[i + 1]
+            if next_concept.get('lessonIds'):
+                targets.append(params.model_copy(update={
+                    'sectionTitle': next_section['title'],
+                    'conceptTitle': next_concept['title'],
+                    'conceptId': next_concept['_id'],
+                    'lessonId': str(next_concept['lessonIds'][0]),
+                }))
+        return targets
+    return []
+
+
+async def _outstanding_prefetches(db: AsyncDatabase, roadmap: dict, roadmap_id: str) -> int:
+    """Prefetches that have not paid off yet, finished jobs whose lesson was opened no longer count against the budget"""
+    in_flight = await db.get_collection(JOBS_COLLECTION).count_documents(
+        {'payload.roadmapId': roadmap_id, 'type': PREFETCH_JOB_TYPE, 'status': {'$in': ['queued', 'running']}}
+    )
+    lesson_ids = [lesson_id for section in roadmap.get('sections', []) for concept in section['concepts'] for lesson_id in concept.get('lessonIds', [])]
+    unclaimed = await db.get_collection('lessons').count_documents(
+        {'_id': {'$in': lesson_ids}, 'prefetched': True, 'content': {'$exists': True}}
+    )
+    return in_flight + unclaimed
+
+
+async def schedule_prefetch(db: AsyncDatabase, params: LessonGenerationParams) -> list[str]:
+    """Queues low priority generation of the lessons the learner is likely to open next, best effort"""
+    if not LESSON_PREFETCH_ENABLED:
+        return []
+    try:
+        return await _schedule_prefetch(db, params)
+    except Exception:
+        logger.exception("Error scheduling lesson prefetch")
+        return []
+
+
+async def _schedule_prefetch(db: AsyncDatabase, params: LessonGenerationParams) -> list[str]:
+    roadmap = await db.get_collection('roadmaps').find_one({'_id': ObjectId(params.roadmapId)}, ROADMAP_OUTLINE_PROJECTION)
+    targets = next_lessons(roadmap, params) if roadmap else []
+    if not targets:
+        return []
+
+    jobs_col = db.get_collection(JOBS_COLLECTION)
+    target_ids = [target.lessonId for target in targets]
+    generated = await db.get_collection('lessons').find(
+        {'_id': {'$in': [ObjectId(lesson_id) for lesson_id in target_ids]}, 'content': {'$exists': True}},
+        {'_id': 1}
+    ).to_list()
+    pending = await jobs_col.find(
+        {'payload.lessonId': {'$in': target_ids}, 'status': {'$in': ['queued', 'running']}},
+        {'payload.lessonId': 1}
+    ).to_list()
+    skip = {str(doc['_id']) for doc in generated} | {job['payload']['lessonId'] for job in pending}
+
+    used = await _outstanding_prefetches(db, roadmap, params.roadmapId)
+
+    job_ids = []
+    for target in targets:
+        if target.lessonId in skip:
+            continue
+        if used >= LESSON_PREFETCH_BUDGET_PER_ROADMAP:
+            logger.info("Prefetch budget of roadmap %s used up", params.roadmapId)
+            break
+        job_ids.append(await enqueue_job(db, PREFETCH_JOB_TYPE, target.model_dump(), priority=JOB_PRIORITY_LOW))
+        used += 1
+
+    if job_ids:
+        logger.info("Prefetching lessons", extra={'roadmap_id': params.roadmapId, 'job_ids': job_ids})
+    return job_ids
+
+
+async def promote_prefetch_job(db: AsyncDatabase, lesson_id: str) -> Optional[str]:
+    """Turns a pending prefetch of the lesson into a regular lesson job, returns its id to poll"""
+    jobs_col = db.get_collection(JOBS_COLLECTION)
+    job = await jobs_col.find_one_and_update(
+        {'type': PREFETCH_JOB_TYPE, 'payload.lessonId': lesson_id, 'status': 'queued'},
+        {'$set': {'type': 'lesson', 'priority': JOB_PRIORITY_NORMAL}}
+    )
+    if job:
+        return str(job['_id'])
+
+    # Already generating, it stays speculative so the lesson is unlocked here instead of when it is saved
+    job = await jobs_col.find_one({'type': PREFETCH_JOB_TYPE, 'payload.lessonId': lesson_id, 'status': 'running'}, {'_id': 1})
+    if job:
+        await db.get_collection('lessons').update_one({'_id': ObjectId(lesson_id)}, {'$set': {'status': 'current'}})
+        # The job claims the lesson after saving it, unless it saved before the status was set
+        await claim_prefetched_lesson(db, lesson_id)
+        return str(job['_id'])
+    return None
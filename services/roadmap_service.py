@@ -0,0 +1,286 @@
+import asyncio
+import base64
+import binascii
+import datetime
+import json
+import logging
+import os
+import uuid
+from datetime import timezone
+from typing import Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from pymongo.asynchronous.database import AsyncDatabase
+from agents.lessons_planner_agent import plan_lessons
+from graphs.roadmap_generation_graph import RoadmapGenerationAgentState, RoadmapStatus, roadmap_generation_graph
+from graphs.runner import run_graph, ProgressCallback
+from utils.log import summarize
+from utils.single_flight import SingleFlight
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Lessons of every concept in this many leading sections are planned when the roadmap is created
+ROADMAP_PLANNED_SECTIONS = int(os.getenv('ROADMAP_PLANNED_SECTIONS', '1'))
+LESSON_PLANNER_CONCURRENCY = int(os.getenv('LESSON_PLANNER_CONCURRENCY', '4'))
+
+# Concurrent /plan-lessons calls for the same concept, in this or another process, share one planner run
+concept_planning = SingleFlight('plan')
+
+
+async def _noop_progress(_stage: str):
+    pass
+
+
+async def plan_concepts(topic: str, targets: list[tuple[dict, dict]]) -> list:
+    """Plans the lessons of every (section, concept) with at most LESSON_PLANNER_CONCURRENCY planner calls at once,
+    a failed concept gets its exception in place of the lessons"""
+    slots = asyncio.Semaphore(LESSON_PLANNER_CONCURRENCY)
+
+    async def plan(section: dict, concept: dict):
+        async with slots:
+            return await plan_lessons(topic=topic, section=section['title'], concept=concept['title'])
+
+    return await asyncio.gather(*(plan(section, concept) for section, concept in targets), return_exceptions=True)
+
+
+async def link_concept_lessons(db: AsyncDatabase, roadmap_id: str, section_id: str, concept_id: str):
+    """Points the concept at its lessons when the roadmap write after inserting them failed, a no-op otherwise"""
+    unlinked = await db.get_collection('roadmaps').find_one(
+        {'_id': ObjectId(roadmap_id), 'sections': {'$elemMatch': {
+            '_id': section_id,
+            'concepts': {'$elemMatch': {'_id': concept_id, 'lessonIds.0': {'$exists': False}}}
+        }}},
+        {'_id': 1}
+    )
+    if not unlinked:
+        return
+
+    lessons = await db.get_collection('lessons').find({'conceptId': concept_id}, {'_id': 1}).sort('order', 1).to_list()
+    logger.warning("Linking %s lessons the concept was missing", len(lessons), extra={'concept_id': concept_id})
+    await db.get_collection('roadmaps').update_one(
+        {'_id': ObjectId(roadmap_id)},
+        {'$set': {"sections.$[section].concepts.$[concept].lessonIds": [lesson['_id'] for lesson in lessons]}},
+        array_filters=[{"section._id": section_id}, {"concept._id": concept_id}]
+    )
+
+
+async def plan_concept_lessons(db: AsyncDatabase, roadmap_id: str, section_id: str, concept_id: str, topic: str, section_title: str, concept_title: str):
+    """Makes sure the concept has planned lessons and its first lesson is unlocked"""
+    lessons_col = db.get_collection('lessons')
+
+    async def load_first_lesson() -> Optional[dict]:
+        return await lessons_col.find_one({'conceptId': concept_id}, {'status': 1}, sort=[('order', 1)])
+
+    async def plan() -> dict:
+        # Planned by a call that finished between the first lookup and taking the lease
+        first_lesson = await load_first_lesson()
+        if first_lesson:
+            return first_lesson
+
+        logger.info("Planning lessons", extra={'concept_id': concept_id})
+        lessons = await plan_lessons(topic=topic, section=section_title, concept=concept_title)
+        lessons_dicts = [{**lesson.model_dump(),
+                          'status': 'current' if i == 0 else 'locked',
+                          'conceptId': concept_id,
+                          'order': i} for i, lesson in enumerate(lessons)]
+        try:
+            insert_result = await lessons_col.insert_many(lessons_dicts)
+            await db.get_collection('roadmaps').update_one(
+                {'_id': ObjectId(roadmap_id)},
+                {
+                    '$set': {"sections.$[section].concepts.$[concept].lessonIds": insert_result.inserted_ids},
+                    '$unset': {"sections.$[section].concepts.$[concept].lessons": ""}
+                },
+                array_filters=[{"section._id": section_id}, {"concept._id": concept_id}]
+            )
+        except Exception:
+            logger.exception("Error saving lessons")
+            raise
+        return {'_id': insert_result.inserted_ids[0], 'status': 'current'}
+
+    # Concepts of the leading sections were planned with the roadmap, unlocking them is only a status change
+    first_lesson = await load_first_lesson() or await concept_planning.run(db, concept_id, plan, load_first_lesson)
+    await link_concept_lessons(db, roadmap_id, section_id, concept_id)
+    if first_lesson.get('status') == 'locked':
+        await lessons_col.update_one({'_id': first_lesson['_id']}, {'$set': {'status': 'current'}})
+
+
+async def generate_and_save_roadmap(db: AsyncDatabase, topic: str, on_progress: Optional[ProgressCallback] = None) -> dict:
+    """Generates roadmap, generates lessons meta, inserts lessons to lessons collection, references them from the concept"""
+    on_progress = on_progress or _noop_progress
+    logger.info("Generating roadmap", extra={'topic': topic})
+
+    initial_state = RoadmapGenerationAgentState(
+        roadmap_status=RoadmapStatus(),
+        topic=topic,
+        messages=[],
+        iteration=0
+    )
+
+    await on_progress('generating_roadmap')
+    roadmap = await run_graph(roadmap_generation_graph, initial_state, on_progress, db)
+
+    logger.debug("Roadmap graph finished: %s", summarize(roadmap))
+
+    roadmaps_col = db.get_collection('roadmaps')
+    lessons_col = db.get_collection('lessons')
+
+    last_message = roadmap['messages'][-1]
+    roadmap_content = json.loads(last_message.content)
+
+    sections_with_id = [
+        {
+            **section,
+            "_id": str(uuid.uuid4()),
+            'status': 'current' if i == 0 else 'locked',
+            'concepts': [
+                {
+                    **concept,
+                    "_id": str(uuid.uuid4()),
+                    'status': 'current' if i == 0 and j == 0 else 'locked',
+                    'lessonIds': []
+                }
+                for j, concept in enumerate(section['concepts'])
+            ]
+        }
+        for i, section in enumerate(roadmap_content["sections"])
+    ]
+
+    first_concept = sections_with_id[0]['concepts'][0]
+    targets = [(section, concept) for section in sections_with_id[:ROADMAP_PLANNED_SECTIONS] for concept in section['concepts']]
+
+    await on_progress('planning_lessons')
+    planned = await plan_concepts(roadmap_content['topic'], targets)
+
+    lessons_dicts = []
+    lesson_concepts = []
+    for (_section, concept), lessons in zip(targets, planned):
+        if isinstance(lessons, Exception):
+            if concept is first_concept:
+                raise lessons
+            # Left without lessons, they are planned through /plan-lessons when the concept is unlocked
+            logger.warning("Could not plan lessons of concept %s: %s", concept['title'], lessons)
+            continue
+        for i, lesson in enumerate(lessons):
+            lessons_dicts.append({
+                **lesson.model_dump(),
+                'status': 'current' if concept is first_concept and i == 0 else 'locked',
+                'conceptId': concept['_id'],
+                'order': i
+            })
+            lesson_concepts.append(concept)
+
+    await on_progress('saving')
+    try:
+        insert_result = await lessons_col.insert_many(lessons_dicts)
+    except Exception:
+        logger.exception("Error saving lessons")
+        raise
+
+    for concept, lesson_id in zip(lesson_concepts, insert_result.inserted_ids):
+        concept['lessonIds'].append(lesson_id)
+
+    doc = {
+        'topic': roadmap_content['topic'],
+        'sections': sections_with_id,
+        'createdAt': datetime.datetime.now(timezone.utc),
+    }
+
+    insert_result = await roadmaps_col.insert_one(doc)
+    logger.info("Roadmap saved", extra={'roadmap_id': str(insert_result.inserted_id)})
+    return {'roadmapId': str(insert_result.inserted_id)}
+
+
+ROADMAP_SUMMARY_PROJECTION = {
+    'topic': 1,
+    'createdAt': 1,
+    'sectionCount': {'$size': {'$ifNull': ['$sections', []]}},
+    'conceptCount': {
+        '$sum': {
+            '$map': {
+                'input': {'$ifNull': ['$sections', []]},
+                'as': 'section',
+                'in': {'$size': {'$ifNull': ['$$section.concepts', []]}}
+            }
+        }
+    },
+}
+
+
+class InvalidCursorError(Exception):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(doc: dict) -> str:
+    raw = f"{doc['createdAt'].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, ObjectId]:
+    try:
+        created_at, object_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.datetime.fromisoformat(created_at), ObjectId(object_id)
+    except (ValueError, InvalidId, binascii.Error, UnicodeDecodeError) as e:
+        raise InvalidCursorError("Invalid cursor.") from e
+
+
+async def list_roadmap_summaries(db: AsyncDatabase, limit: int, cursor: Optional[str] = None) -> dict:
+    """One page of roadmaps, newest first, without the embedded sections"""
+    pipeline = []
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        pipeline.append({'$match': {'$or': [
+            {'createdAt': {'$lt': created_at}},
+            {'createdAt': created_at, '_id': {'$lt': last_id}},
+        ]}})
+    pipeline += [
+        {'$sort': {'createdAt': -1, '_id': -1}},
+        {'$limit': limit + 1},
+        {'$project': ROADMAP_SUMMARY_PROJECTION},
+    ]
+
+    cursor_result = await db.get_collection('roadmaps').aggregate(pipeline)
+    roadmaps = await cursor_result.to_list()
+
+    next_cursor = encode_cursor(roadmaps[limit - 1]) if len(roadmaps) > limit else None
+    return {'roadmaps': roadmaps[:limit], 'nextCursor': next_cursor}
+
+
+LESSON_SUMMARY_PROJECTION = {
+    'title': 1,
+    'description': 1,
+    'learning_objectives': 1,
+    'status': 1,
+    'order': 1,
+    'conceptId': 1,
+}
+
+
+async def attach_lessons(db: AsyncDatabase, roadmap: dict) -> dict:
+    """Resolves the lessonIds of every concept into lesson summaries with a single query"""
+    concepts = [concept for section in roadmap.get('sections', []) for concept in section.get('concepts', [])]
+    lesson_ids = [lesson_id for concept in concepts for lesson_id in concept.get('lessonIds', [])]
+    if not lesson_ids:
+        return roadmap
+
+    lessons = await db.get_collection('lessons').find({'_id': {'$in': lesson_ids}}, LESSON_SUMMARY_PROJECTION).to_list()
+    lessons_by_id = {lesson['_id']: lesson for lesson in lessons}
+
+    for concept in concepts:
+        if 'lessonIds' in concept:
+            concept['lessons'] = [lessons_by_id[lesson_id] for lesson_id in concept['lessonIds'] if lesson_id in lessons_by_id]
+    return roadmap
+
+
+async def get_roadmap(db: AsyncDatabase, roadmap_id: str, with_lessons: bool = True) -> Optional[dict]:
+    try:
+        object_id = ObjectId(roadmap_id)
+    except InvalidId:
+        return None
+    roadmap = await db.get_collection('roadmaps').find_one({'_id': object_id})
+    if roadmap and with_lessons:
+        await attach_lessons(db, roadmap)
+    return roadmap
@@ -0,0 +1,24 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SYNC_EXECUTOR_MAX_WORKERS = int(os.getenv('SYNC_EXECUTOR_MAX_WORKERS', '16'))
+
+sync_executor = ThreadPoolExecutor(
+    max_workers=SYNC_EXECUTOR_MAX_WORKERS,
+    thread_name_prefix='skillflow-sync'
+)
+
+
+async def run_sync(func, *args, **kwargs):
+    """Runs a blocking callable on the bounded executor so it never blocks the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(sync_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor():
+    sync_executor.shutdown(wait=False, cancel_futures=True)
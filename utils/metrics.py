@@ -0,0 +1,130 @@
+import functools
+import time
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
+
+LLM_LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+HTTP_REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency by route',
+    ['method', 'route', 'status'],
+)
+GRAPH_NODE_LATENCY = Histogram(
+    'graph_node_duration_seconds',
+    'Time spent in each LangGraph node',
+    ['graph', 'node'],
+    buckets=LLM_LATENCY_BUCKETS,
+)
+LLM_CALL_LATENCY = Histogram(
+    'llm_call_duration_seconds',
+    'Latency of structured-output model calls',
+    ['agent', 'model', 'outcome'],
+    buckets=LLM_LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    'llm_tokens_total',
+    'Prompt and completion tokens reported by the provider',
+    ['agent', 'model', 'kind'],
+)
+LLM_ROUTING_EVENTS = Counter(
+    'llm_routing_events_total',
+    'Hedged and fallback model calls, and calls served by a model other than the primary',
+    ['agent', 'model', 'event'],
+)
+LLM_CIRCUIT_OPEN = Gauge(
+    'llm_circuit_open',
+    'Whether the circuit breaker of a provider is open',
+    ['provider'],
+)
+LLM_QUEUE_WAIT = Histogram(
+    'llm_queue_wait_seconds',
+    'Time a model call waited for its turn under the provider rate limits',
+    ['provider', 'priority'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120),
+)
+LLM_QUEUE_TIMEOUTS = Counter(
+    'llm_queue_timeouts_total',
+    'Model calls that gave up waiting for their turn',
+    ['provider', 'priority'],
+)
+LLM_CACHE_LOOKUPS = Counter(
+    'llm_cache_lookups_total',
+    'LLM response cache lookups',
+    ['agent', 'tier', 'outcome'],
+)
+LESSON_CONTEXT_TOKENS = Histogram(
+    'lesson_context_tokens',
+    'Tokens in the roadmap outline sent to the lesson generator',
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000),
+)
+LESSON_VALIDATIONS = Counter(
+    'lesson_validations_total',
+    'Lessons checked by the local validator, by where they were routed next',
+    ['outcome'],
+)
+MONGO_OPERATION_LATENCY = Histogram(
+    'mongo_operation_duration_seconds',
+    'MongoDB command latency',
+    ['command', 'outcome'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+JOBS_IN_FLIGHT = Gauge(
+    'jobs_in_flight',
+    'Jobs currently running on this worker',
+    ['type'],
+)
+
+
+def timed_node(graph: str, node: str, func):
+    """Wraps an async graph node so its duration is recorded under the node name it is registered with"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            GRAPH_NODE_LATENCY.labels(graph, node).observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records the latency of every command the client sends"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_OPERATION_LATENCY.labels(event.command_name, 'success').observe(event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        MONGO_OPERATION_LATENCY.labels(event.command_name, 'failure').observe(event.duration_micros / 1_000_000)
+
+
+class PrometheusMiddleware:
+    """ASGI middleware timing each request until its response has been fully sent"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {'code': 500}
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            route_path = getattr(route, 'path', 'unmatched')
+            if route_path != '/metrics':
+                HTTP_REQUEST_LATENCY.labels(scope['method'], route_path, str(status['code'])).observe(time.perf_counter() - started)
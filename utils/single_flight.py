@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Optional, TypeVar
+from dotenv import load_dotenv
+from pymongo.asynchronous.database import AsyncDatabase
+from db.leases import acquire_lease, release_lease, renew_lease, wait_for_release
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_LEASE_SECONDS = int(os.getenv('SINGLE_FLIGHT_LEASE_SECONDS', '120'))
+SINGLE_FLIGHT_POLL_SECONDS = float(os.getenv('SINGLE_FLIGHT_POLL_SECONDS', '0.5'))
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time. Callers in this process share the running call's result, callers in
+    other processes wait until the Mongo lease of the running call is released and then load what it stored"""
+
+    def __init__(self, namespace: str, lease_seconds: int = SINGLE_FLIGHT_LEASE_SECONDS, poll_interval: float = SINGLE_FLIGHT_POLL_SECONDS):
+        self.namespace = namespace
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self._calls: dict[str, asyncio.Task] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    async def run(self, db: AsyncDatabase, key: str, func: Callable[[], Awaitable[T]], load_result: Callable[[], Awaitable[Optional[T]]]) -> T:
+        """`func` computes and stores the result, `load_result` reads a result stored by another process (None if there is none)"""
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.create_task(self._run_leased(db, key, func, load_result))
+            self._calls[key] = call
+            call.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            logger.info("Joining in-flight %s call for %s", self.namespace, key)
+        # A cancelled caller must not cancel the call the other callers are waiting on
+        return await asyncio.shield(call)
+
+    def _forget(self, key: str, call: asyncio.Task):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.cancelled():
+            # Marks the exception as retrieved when every caller has gone away
+            call.exception()
+
+    async def _run_leased(self, db: AsyncDatabase, key: str, func, load_result):
+        lease_id = f"{self.namespace}:{key}"
+        while True:
+            if await acquire_lease(db, lease_id, self.owner, self.lease_seconds):
+                heartbeat = asyncio.create_task(self._keep_lease(db, lease_id))
+                try:
+                    return await func()
+                finally:
+                    heartbeat.cancel()
+                    await release_lease(db, lease_id, self.owner)
+
+            logger.info("Waiting for %s call for %s running elsewhere", self.namespace, key)
+            await wait_for_release(db, lease_id, self.poll_interval)
+            result = await load_result()
+            if result is not None:
+                return result
+            # The other call ended without storing a result, take over
+
+    async def _keep_lease(self, db: AsyncDatabase, lease_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await renew_lease(db, lease_id, self.owner, self.lease_seconds)
+            except Exception:
+                # Keep renewing, one missed renewal still leaves two thirds of the lease
+                logger.exception("Error renewing %s lease %s", self.namespace, lease_id)
@@ -0,0 +1,29 @@
+import functools
+import logging
+from utils.executor import run_sync
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def _encoding(model: str):
+    """tiktoken encoding for the model, None when it can't be loaded (e.g. no network to fetch the BPE file)"""
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        logger.warning("Falling back to approximate token counts for %s: %s", model, e)
+        return None
+
+
+async def warm_up_encoding(model: str = 'gpt-4o-mini'):
+    """Loads the encoding on the executor at startup, the first load downloads and parses the BPE file"""
+    await run_sync(_encoding, model)
+
+
+def count_tokens(text: str, model: str = 'gpt-4o-mini') -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        # Roughly four characters per token for English text
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
@@ -0,0 +1,82 @@
+import contextlib
+import functools
+import os
+import sentry_sdk
+from dotenv import load_dotenv
+from pymongo import monitoring
+from sentry_sdk.integrations.pymongo import PyMongoIntegration
+
+load_dotenv()
+
+SENTRY_DSN = os.getenv('SENTRY_DSN')
+SENTRY_TRACES_SAMPLE_RATE = float(os.getenv('SENTRY_TRACES_SAMPLE_RATE', '0.1'))
+SENTRY_ENVIRONMENT = os.getenv('SENTRY_ENVIRONMENT')
+
+
+def init_sentry():
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        send_default_pii=True,
+        environment=SENTRY_ENVIRONMENT,
+        traces_sample_rate=SENTRY_TRACES_SAMPLE_RATE,
+        # Replaced by MongoCommandTracer, the bundled one deep copies and serializes every command
+        disabled_integrations=[PyMongoIntegration()],
+    )
+
+
+def traced_node(graph: str, node: str, func):
+    """Wraps an async graph node in a span named after the node it is registered as"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with sentry_sdk.start_span(op='graph.node', name=f"{graph}.{node}"):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+class MongoCommandTracer(monitoring.CommandListener):
+    """Opens a child span of the current span for every command the client sends"""
+
+    def __init__(self):
+        self._spans = {}
+
+    def started(self, event):
+        parent = sentry_sdk.get_current_span()
+        if parent is None or not parent.sampled:
+            return
+        collection = event.command.get(event.command_name)
+        name = f"{event.command_name} {collection}" if isinstance(collection, str) else event.command_name
+        span = parent.start_child(op='db', name=name)
+        span.set_data('db.system', 'mongodb')
+        span.set_data('db.name', event.database_name)
+        span.set_data('db.operation', event.command_name)
+        self._spans[(event.connection_id, event.request_id)] = span
+
+    def _finish(self, event, status: str):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.set_status(status)
+            span.finish()
+
+    def succeeded(self, event):
+        self._finish(event, 'ok')
+
+    def failed(self, event):
+        self._finish(event, 'internal_error')
+
+
+def trace_headers() -> dict:
+    """Headers that let a job continue the trace of the request that queued it"""
+    headers = {'sentry-trace': sentry_sdk.get_traceparent(), 'baggage': sentry_sdk.get_baggage()}
+    return {key: value for key, value in headers.items() if value}
+
+
+@contextlib.contextmanager
+def job_transaction(job: dict):
+    """Runs a job in its own scope and transaction, linked to the trace of the request that queued it"""
+    with sentry_sdk.isolation_scope():
+        transaction = sentry_sdk.continue_trace(job.get('trace') or {}, op='queue.task', name=f"job.{job['type']}")
+        with sentry_sdk.start_transaction(transaction) as transaction:
+            transaction.set_data('job.id', str(job['_id']))
+            transaction.set_data('job.attempt', job['attempts'])
+            yield transaction